@@ -30,6 +30,7 @@ bl_info = {
 if "bpy" in locals():
     import importlib
     importlib.reload(ui)
+    importlib.reload(mesh_helpers)
     importlib.reload(operators)
 else:
     import bpy
@@ -49,10 +50,12 @@ else:
             )
     from . import (
             ui,
+            mesh_helpers,
             operators,
             )
 
 import math
+import time
 from bpy.app.handlers import persistent
 
 class MolPrintSettings(PropertyGroup):
@@ -140,6 +143,24 @@ class MolPrintSettings(PropertyGroup):
             description="Autogroup and color on the fly, may be slow with many objects",
             default=True,
             )
+    group_delay = FloatProperty(
+            name="Group delay",
+            description="Seconds the selection must stay unchanged before groups are updated",
+            default=0.25,
+            precision=2,
+            min=0.0, max=2.0,
+            )
+    parallel_groups = BoolProperty(
+            name="Parallel Groups",
+            description="Finish each group's booleans in a background Blender process, one per core",
+            default=False,
+            )
+    group_workers = IntProperty(
+            name="Workers",
+            description="Background processes for Parallel Groups, 0 uses every core",
+            default=0,
+            min=0, max=64,
+            )
     splitpins = BoolProperty(
             name="Split Pins",
             description="Split pins with conic heads",
@@ -251,19 +272,35 @@ class printerpreferences(bpy.types.AddonPreferences):
         col.prop(self, "category", text="")
 
 class MolPrintLists():
-    interactionlist = []
-    internames = []
+    interactiongraph = mesh_helpers.InteractionGraph()
     grouplist = []
+    groupmap = {}
+    partition = None
     selectedlist = []
     floorlist = []
+    #Autogroup scheduling: a burst of selection changes becomes one update
+    pendingupdate = False
+    lastchange = 0.0
+    skippedupdates = 0
 
 #Where is the best place to put this? Really not sure.
 @persistent
 def updategroups(scene):
     #Ignore this callback if conditions not met
     if bpy.context.scene.molprint.interact and bpy.context.scene.molprint.autogroup:     
-        if bpy.context.scene.molprint_lists.selectedlist != bpy.context.selected_objects:
-            bpy.context.scene.molprint_lists.selectedlist = bpy.context.selected_objects
+        lists = bpy.context.scene.molprint_lists
+        now = time.time()
+        if lists.selectedlist != bpy.context.selected_objects:
+            lists.selectedlist = bpy.context.selected_objects
+            #Still changing (e.g. box select), wait until it settles
+            if lists.pendingupdate:
+                lists.skippedupdates += 1
+            lists.pendingupdate = True
+            lists.lastchange = now
+            return
+        #This handler fires continuously, so the pending update runs once stable
+        if lists.pendingupdate and now - lists.lastchange >= bpy.context.scene.molprint.group_delay:
+            lists.pendingupdate = False
             #print("Do some group update")
             bpy.ops.mesh.molprint_updategroups()
     return
@@ -25,6 +25,7 @@ import os
 import shlex
 import math
 
+from array import array
 from math import sin, cos, pi
 
 texture_cache = {}
@@ -63,6 +64,50 @@ def imageConvertCompat(path):
 
 # =============================== VRML Spesific
 
+def vrml_numbers(l):
+    """
+    Parse a line of numbers in one go, commas and all.
+    Return array('i'), array('f'), or None if this needs the slow path.
+    """
+    tokens = l.replace(',', ' ').split()
+    try:
+        return array('i', map(int, tokens))
+    except OverflowError:
+        # Packed pixels and the like, keep them as python ints
+        return None
+    except ValueError:
+        pass
+    try:
+        return array('f', map(float, tokens))
+    except ValueError:
+        return None
+
+
+def array_extend(array_data, values):
+    """
+    Add values to array data, staying a flat array.array while every
+    line added was numeric. Return the (possibly new) array data.
+    """
+    if type(values) == array:
+        if type(array_data) == array:
+            if array_data.typecode != values.typecode:
+                # ints and floats mixed, floats it is
+                if array_data.typecode == 'i':
+                    array_data = array('f', array_data)
+                else:
+                    values = array('f', values)
+            array_data.extend(values)
+            return array_data
+        if not array_data:
+            return values
+        values = values.tolist()
+    elif type(array_data) == array:
+        array_data = array_data.tolist()
+
+    array_data.extend(values)
+    return array_data
+
+
 def vrml_split_fields(value):
     """
     key 0.0 otherkey 1,2,3 opt1 opt1 0.0
@@ -102,43 +147,73 @@ def vrml_split_fields(value):
     return field_list
 
 
-def vrmlFormat(data):
-    """
-    Keep this as a valid vrml file, but format in a way we can predict.
-    """
-    # Strip all commends - # not in strings - warning multiline strings are ignored.
-    def strip_comment(l):
-        #l = ' '.join(l.split())
-        l = l.strip()
+# Strip all commends - # not in strings - warning multiline strings are ignored.
+def vrml_strip_comment(l):
+    #l = ' '.join(l.split())
+    l = l.strip()
 
-        if l.startswith('#'):
-            return ''
+    if l.startswith('#'):
+        return ''
 
-        i = l.find('#')
+    i = l.find('#')
 
-        if i == -1:
-            return l
+    if i == -1:
+        return l
 
-        # Most cases accounted for! if we have a comment at the end of the line do this...
-        #j = l.find('url "')
-        j = l.find('"')
+    # Most cases accounted for! if we have a comment at the end of the line do this...
+    #j = l.find('url "')
+    j = l.find('"')
 
-        if j == -1:  # simple no strings
-            return l[:i].strip()
+    if j == -1:  # simple no strings
+        return l[:i].strip()
 
-        q = False
-        for i, c in enumerate(l):
-            if c == '"':
-                q = not q  # invert
+    q = False
+    for i, c in enumerate(l):
+        if c == '"':
+            q = not q  # invert
 
-            elif c == '#':
-                if q is False:
-                    return l[:i - 1]
+        elif c == '#':
+            if q is False:
+                return l[:i - 1]
 
-        return l
+    return l
+
+
+def vrmlFormat(data):
+    """
+    Keep this as a valid vrml file, but format in a way we can predict.
+    """
+    return list(vrmlFormatStream(data.split('\n')))
 
-    data = '\n'.join([strip_comment(l) for l in data.split('\n')])  # remove all whitespace
 
+def vrmlFormatStream(filelines, blocksize=1 << 16):
+    """
+    Same as vrmlFormat but takes the file a line at a time (an open file
+    works) and yields the formatted lines, so the file is never held as
+    one string with copies of it.
+    """
+    # Formatting is line local apart from strings, so blocks are only
+    # cut where all quotes are closed.
+    block = []
+    size = 0
+    quotes = 0
+    for l in filelines:
+        l = vrml_strip_comment(l)
+        block.append(l)
+        size += len(l)
+        quotes += l.count('"')
+        if quotes % 2 == 0 and size >= blocksize:
+            yield from vrmlFormatBlock('\n'.join(block))
+            block = []
+            size = 0
+            quotes = 0
+
+    if block:
+        yield from vrmlFormatBlock('\n'.join(block))
+
+
+def vrmlFormatBlock(data):
+    # data has had comments stripped, line by line
     EXTRACT_STRINGS = True  # only needed when strings or filesnames containe ,[]{} chars :/
 
     if EXTRACT_STRINGS:
@@ -146,28 +221,14 @@ def vrmlFormat(data):
         # We need this so we can detect URL's
         data = '\n'.join([' '.join(l.split()) for l in data.split('\n')])  # remove all whitespace
 
-        string_ls = []
-
-        #search = 'url "'
-        search = '"'
-
-        ok = True
-        last_i = 0
-        while ok:
-            ok = False
-            i = data.find(search, last_i)
-            if i != -1:
-
-                start = i + len(search)  # first char after end of search
-                end = data.find('"', start)
-                if end != -1:
-                    item = data[start:end]
-                    string_ls.append(item)
-                    data = data[:start] + data[end:]
-                    ok = True  # keep looking
-
-                    last_i = (end - len(item)) + 1
-                    # print(last_i, item, '|' + data[last_i] + '|')
+        # Every pair of quotes is emptied out, one split instead of
+        # rebuilding the whole buffer for each string.
+        parts = data.split('"')
+        string_ls = parts[1:len(parts) - 1:2]
+        data = '""'.join(parts[0::2][:len(string_ls) + 1])
+        if len(parts) % 2 == 0:
+            # unmatched quote, leave the rest as it is
+            data += '"' + parts[-1]
 
     # done with messy extracting strings part
 
@@ -189,23 +250,23 @@ def vrmlFormat(data):
     if EXTRACT_STRINGS:
         # add strings back in
 
-        search = '"'  # fill in these empty strings
-
-        ok = True
+        # fill in these empty strings, collecting chunks rather than
+        # splicing into data each time
+        chunks = []
+        chunk_start = 0
         last_i = 0
-        while ok:
-            ok = False
-            i = data.find(search + '"', last_i)
-            # print(i)
-            if i != -1:
-                start = i + len(search)  # first char after end of search
-                item = string_ls.pop(0)
-                # print(item)
-                data = data[:start] + item + data[start:]
-
-                last_i = start + len(item) + 1
+        for item in string_ls:
+            i = data.find('""', last_i)
+            if i == -1:
+                break
+            start = i + 1  # first char after the opening quote
+            chunks.append(data[chunk_start:start])
+            chunks.append(item)
+            chunk_start = start
+            last_i = start + 1
 
-                ok = True
+        chunks.append(data[chunk_start:])
+        data = ''.join(chunks)
 
     # More annoying obscure cases where USE or DEF are placed on a newline
     # data = data.replace('\nDEF ', ' DEF ')
@@ -383,7 +444,9 @@ class vrmlNode(object):
                  'ROUTE_IPO_NAMESPACE',
                  'PROTO_NAMESPACE',
                  'x3dNode',
-                 'parsed')
+                 'parsed',
+                 'field_index',
+                 'proto_cache')
 
     def __init__(self, parent, node_type, lineno):
         self.id = None
@@ -393,6 +456,8 @@ class vrmlNode(object):
         self.blendData = None
         self.x3dNode = None  # for x3d import only
         self.parsed = None  # We try to reuse objects in a smart way
+        self.field_index = None  # field name -> field, built on first lookup
+        self.proto_cache = None  # resolved 'IS' fields, per ancestry
         if parent:
             parent.children.append(self)
 
@@ -600,72 +665,93 @@ class vrmlNode(object):
             child.searchNodeTypeID(node_spec, results)
         return results
 
+    def getFieldIndex(self):
+        """ Return a dict of field name to field, the first field wins like the old scan """
+        if self.field_index is None:
+            field_index = {}
+            for f in self.fields:
+                if f and f[0] not in field_index:
+                    field_index[f[0]] = f
+            self.field_index = field_index
+        return self.field_index
+
+    def getProtoFieldValue(self, field_id, ancestry, AS_CHILD):
+        """ Resolve a proto field from its default and the instance overriding it """
+        f_proto_lookup = None
+        f_proto_child_lookup = None
+        i = len(ancestry)
+        while i:
+            i -= 1
+            node = ancestry[i]
+            node = node.getRealNode()
+
+            # proto settings are stored in "self.proto_node"
+            if node.proto_node:
+                # Get the default value from the proto, this can be overwridden by the proto instace
+                # 'field SFColor legColor .8 .4 .7'
+                if AS_CHILD:
+                    for child in node.proto_node.children:
+                        #if child.id  and  len(child.id) >= 3  and child.id[2]==field_id:
+                        if child.id and ('point' in child.id or 'points' in child.id):
+                            f_proto_child_lookup = child
+
+                else:
+                    for f_def in node.proto_node.proto_field_defs:
+                        if len(f_def) >= 4:
+                            if f_def[0] == 'field' and f_def[2] == field_id:
+                                f_proto_lookup = f_def[3:]
+
+            # Node instance, Will be 1 up from the proto-node in the ancestry list. but NOT its parent.
+            # This is the setting as defined by the instance, including this setting is optional,
+            # and will override the default PROTO value
+            # eg: 'legColor 1 0 0'
+            if AS_CHILD:
+                for child in node.children:
+                    if child.id and child.id[0] == field_id:
+                        f_proto_child_lookup = child
+            else:
+                for f_def in node.fields:
+                    if len(f_def) >= 2:
+                        if f_def[0] == field_id:
+                            if DEBUG:
+                                print("getFieldName(), found proto", f_def)
+                            f_proto_lookup = f_def[1:]
+
+        if AS_CHILD:
+            if f_proto_child_lookup:
+                if DEBUG:
+                    print("getFieldName() - AS_CHILD=True, child found")
+                    print(f_proto_child_lookup)
+            return f_proto_child_lookup
+        else:
+            return f_proto_lookup
+
     def getFieldName(self, field, ancestry, AS_CHILD=False, SPLIT_COMMAS=False):
         self_real = self.getRealNode()  # in case we're an instance
 
-        for f in self_real.fields:
-            # print(f)
-            if f and f[0] == field:
-                # print('\tfound field', f)
-
-                if len(f) >= 3 and f[1] == 'IS':  # eg: 'diffuseColor IS legColor'
-                    field_id = f[2]
-
-                    # print("\n\n\n\n\n\nFOND IS!!!")
-                    f_proto_lookup = None
-                    f_proto_child_lookup = None
-                    i = len(ancestry)
-                    while i:
-                        i -= 1
-                        node = ancestry[i]
-                        node = node.getRealNode()
-
-                        # proto settings are stored in "self.proto_node"
-                        if node.proto_node:
-                            # Get the default value from the proto, this can be overwridden by the proto instace
-                            # 'field SFColor legColor .8 .4 .7'
-                            if AS_CHILD:
-                                for child in node.proto_node.children:
-                                    #if child.id  and  len(child.id) >= 3  and child.id[2]==field_id:
-                                    if child.id and ('point' in child.id or 'points' in child.id):
-                                        f_proto_child_lookup = child
+        f = self_real.getFieldIndex().get(field)
+        if f is not None:
+            # print('\tfound field', f)
 
-                            else:
-                                for f_def in node.proto_node.proto_field_defs:
-                                    if len(f_def) >= 4:
-                                        if f_def[0] == 'field' and f_def[2] == field_id:
-                                            f_proto_lookup = f_def[3:]
-
-                        # Node instance, Will be 1 up from the proto-node in the ancestry list. but NOT its parent.
-                        # This is the setting as defined by the instance, including this setting is optional,
-                        # and will override the default PROTO value
-                        # eg: 'legColor 1 0 0'
-                        if AS_CHILD:
-                            for child in node.children:
-                                if child.id and child.id[0] == field_id:
-                                    f_proto_child_lookup = child
-                        else:
-                            for f_def in node.fields:
-                                if len(f_def) >= 2:
-                                    if f_def[0] == field_id:
-                                        if DEBUG:
-                                            print("getFieldName(), found proto", f_def)
-                                        f_proto_lookup = f_def[1:]
+            if len(f) >= 3 and f[1] == 'IS':  # eg: 'diffuseColor IS legColor'
+                # The same shape is looked up many times per proto instance
+                if self_real.proto_cache is None:
+                    self_real.proto_cache = {}
+                key = (field, AS_CHILD, tuple(ancestry))
+                try:
+                    value = self_real.proto_cache[key]
+                except KeyError:
+                    value = self_real.proto_cache[key] = self_real.getProtoFieldValue(f[2], ancestry, AS_CHILD)
 
-                    if AS_CHILD:
-                        if f_proto_child_lookup:
-                            if DEBUG:
-                                print("getFieldName() - AS_CHILD=True, child found")
-                                print(f_proto_child_lookup)
-                        return f_proto_child_lookup
-                    else:
-                        return f_proto_lookup
+                if type(value) == list:
+                    return value[:]  # callers may edit it
+                return value
+            else:
+                if AS_CHILD:
+                    return None
                 else:
-                    if AS_CHILD:
-                        return None
-                    else:
-                        # Not using a proto
-                        return f[1:]
+                    # Not using a proto
+                    return f[1:]
         # print('\tfield not found', field)
 
         # See if this is a proto name
@@ -796,12 +882,15 @@ class vrmlNode(object):
         def array_as_number(array_string):
             array_data = []
             try:
-                array_data = [int(val, 0) for val in array_string]
+                array_data = array('i', map(int, array_string))
             except:
                 try:
-                    array_data = [float(val) for val in array_string]
+                    array_data = [int(val, 0) for val in array_string]
                 except:
-                    print('\tWarning, could not parse array data from field')
+                    try:
+                        array_data = array('f', map(float, array_string))
+                    except:
+                        print('\tWarning, could not parse array data from field')
 
             return array_data
 
@@ -833,6 +922,17 @@ class vrmlNode(object):
         if group == -1 or len(array_data) == 0:
             return array_data
 
+        if type(array_data) == array:
+            # Numeric fast path, already flat. Callers may edit the result,
+            # so hand out a copy. foreach_set takes it as a buffer.
+            if group == 0:
+                return array_data[:]
+            flat = array_data.tolist()
+            new_array = [flat[i:i + group] for i in range(0, len(flat) - group + 1, group)]
+            if len(flat) % group:
+                print('\twarning, array was not aligned to requested grouping', group, 'remaining value', flat[len(flat) - len(flat) % group:])
+            return new_array
+
         # We want a flat list
         flat = True
         for item in array_data:
@@ -1024,20 +1124,21 @@ class vrmlNode(object):
                         print('\tWarning: cant Inline yourself recursively:', url)
                     else:
 
-                        try:
-                            data = gzipOpen(url)
-                        except:
+                        filehandle = vrmlOpen(url)
+                        if filehandle is None:
                             print('\tWarning: cant open the file:', url)
-                            data = None
+                        else:
+                            with filehandle:
+                                data = list(vrmlFormatStream(filehandle))
 
-                        if data:
+                        if filehandle is not None and data:
                             # Tricky - inline another VRML
                             print('\tLoading Inline:"%s"...' % url)
 
                             # Watch it! - backup lines
                             lines_old = lines[:]
 
-                            lines[:] = vrmlFormat(data)
+                            lines[:] = data
 
                             lines.insert(0, '{')
                             lines.insert(0, 'root_node____')
@@ -1180,6 +1281,13 @@ class vrmlNode(object):
                 i = child.parse(i)
 
             elif is_numline(i):
+                values = vrml_numbers(l)
+                if values is not None:
+                    if values:
+                        self.array_data = array_extend(self.array_data, values)
+                    i += 1
+                    continue
+
                 l_split = l.split(',')
 
                 values = None
@@ -1204,7 +1312,7 @@ class vrmlNode(object):
                 # This should not extend over multiple lines however it is possible
                 # print(self.array_data)
                 if values:
-                    self.array_data.extend(values)
+                    self.array_data = array_extend(self.array_data, values)
                 i += 1
             else:
                 words = l.split()
@@ -1245,6 +1353,7 @@ class vrmlNode(object):
                             self.proto_field_defs.append(value)
                         else:
                             self.fields.append(value)
+                            self.field_index = None
                 i += 1
 
     # This is a prerequisite for DEF/USE-based material caching
@@ -1256,27 +1365,44 @@ class vrmlNode(object):
         return None
 
 
-def gzipOpen(path):
+def vrmlOpen(path):
+    """
+    Open a VRML file as text, gunzipping on the fly when needed.
+    Return a file object, or None.
+    """
     import gzip
 
-    data = None
     try:
-        data = gzip.open(path, 'r').read()
+        with open(path, 'rb') as filehandle:
+            magic = filehandle.read(2)
+        if magic == b'\x1f\x8b':
+            return gzip.open(path, 'rt', encoding='utf-8', errors='surrogateescape')
+        return open(path, 'r', encoding='utf-8', errors='surrogateescape')
     except:
-        pass
+        import traceback
+        traceback.print_exc()
 
-    if data is None:
-        try:
-            filehandle = open(path, 'rU', encoding='utf-8', errors='surrogateescape')
-            data = filehandle.read()
-            filehandle.close()
-        except:
-            import traceback
-            traceback.print_exc()
-    else:
-        data = data.decode(encoding='utf-8', errors='surrogateescape')
+    return None
+
+
+def x3dOpen(path):
+    """
+    Open an X3D file as bytes for the XML parser, gunzipping on the fly when needed.
+    Return a file object, or None.
+    """
+    import gzip
+
+    try:
+        with open(path, 'rb') as filehandle:
+            magic = filehandle.read(2)
+        if magic == b'\x1f\x8b':
+            return gzip.open(path, 'rb')
+        return open(path, 'rb')
+    except:
+        import traceback
+        traceback.print_exc()
 
-    return data
+    return None
 
 
 def vrml_parse(path):
@@ -1284,13 +1410,14 @@ def vrml_parse(path):
     Sets up the root node and returns it so load_web3d() can deal with the blender side of things.
     Return root (vrmlNode, '') or (None, 'Error String')
     """
-    data = gzipOpen(path)
+    filehandle = vrmlOpen(path)
 
-    if data is None:
+    if filehandle is None:
         return None, 'Failed to open file: ' + path
 
-    # Stripped above
-    lines[:] = vrmlFormat(data)
+    # Read and formatted as a stream
+    with filehandle:
+        lines[:] = vrmlFormatStream(filehandle)
 
     lines.insert(0, '{')
     lines.insert(0, 'dymmy_node')
@@ -1330,6 +1457,24 @@ def vrml_parse(path):
 
 # ====================== X3d Support
 
+class x3dElement(object):
+    """
+    What we keep of an XML element: tag, attributes and where it started.
+    The tree itself is made of x3dNode's, there is no DOM.
+    """
+    __slots__ = ('tagName',
+                 'attributes',
+                 'parse_position')
+
+    def __init__(self, tagName, attributes, parse_position):
+        self.tagName = tagName
+        self.attributes = attributes
+        self.parse_position = parse_position
+
+    def getAttribute(self, name):
+        return self.attributes.get(name)
+
+
 # Sane as vrml but replace the parser
 class x3dNode(vrmlNode):
     def __init__(self, parent, node_type, x3dNode):
@@ -1337,36 +1482,24 @@ class x3dNode(vrmlNode):
         self.x3dNode = x3dNode
 
     def parse(self, IS_PROTO_DATA=False):
+        # Children are added by x3d_parse() as the file is read,
+        # this only resolves DEF/USE for the element just started.
         # print(self.x3dNode.tagName)
         self.lineno = self.x3dNode.parse_position[0]
 
-        define = self.x3dNode.getAttributeNode('DEF')
+        define = self.x3dNode.getAttribute('DEF')
         if define:
-            self.getDefDict()[define.value] = self
+            self.getDefDict()[define] = self
         else:
-            use = self.x3dNode.getAttributeNode('USE')
+            use = self.x3dNode.getAttribute('USE')
             if use:
                 try:
-                    self.reference = self.getDefDict()[use.value]
+                    self.reference = self.getDefDict()[use]
                     self.node_type = NODE_REFERENCE
                 except:
-                    print('\tWarning: reference', use.value, 'not found')
+                    print('\tWarning: reference', use, 'not found')
                     self.parent.children.remove(self)
 
-                return
-
-        for x3dChildNode in self.x3dNode.childNodes:
-            if x3dChildNode.nodeType in {x3dChildNode.TEXT_NODE, x3dChildNode.COMMENT_NODE, x3dChildNode.CDATA_SECTION_NODE}:
-                continue
-
-            node_type = NODE_NORMAL
-            # print(x3dChildNode, dir(x3dChildNode))
-            if x3dChildNode.getAttributeNode('USE'):
-                node_type = NODE_REFERENCE
-
-            child = x3dNode(self, node_type, x3dChildNode)
-            child.parse()
-
         # TODO - x3d Inline
 
     def getSpec(self):
@@ -1374,12 +1507,12 @@ class x3dNode(vrmlNode):
 
     # Used to retain object identifiers from X3D to Blender
     def getDefName(self):
-        node_id = self.x3dNode.getAttributeNode('DEF')
+        node_id = self.x3dNode.getAttribute('DEF')
         if node_id:
-            return node_id.value
-        node_id = self.x3dNode.getAttributeNode('USE')
+            return node_id
+        node_id = self.x3dNode.getAttribute('USE')
         if node_id:
-            return "USE_" + node_id.value
+            return "USE_" + node_id
         return None
 
     # Other funcs operate from vrml, but this means we can wrap XML fields, still use nice utility funcs
@@ -1388,10 +1521,8 @@ class x3dNode(vrmlNode):
         # ancestry and AS_CHILD are ignored, only used for VRML now
 
         self_real = self.getRealNode()  # in case we're an instance
-        field_xml = self.x3dNode.getAttributeNode(field)
-        if field_xml:
-            value = field_xml.value
-
+        value = self.x3dNode.getAttribute(field)
+        if value is not None:
             # We may want to edit. for x3d specific stuff
             # Sucks a bit to return the field name in the list but vrml excepts this :/
             if SPLIT_COMMAS:
@@ -1401,10 +1532,21 @@ class x3dNode(vrmlNode):
             return None
 
     def canHaveReferences(self):
-        return self.x3dNode.getAttributeNode('DEF')
+        return self.x3dNode.getAttribute('DEF')
 
     def desc(self):
-        return self.getRealNode().x3dNode.toxml()
+        return self.getRealNode().toxml()
+
+    def toxml(self):
+        # Same text for the same element and subtree, used as a cache key
+        elem = self.x3dNode
+        text = '<' + elem.tagName
+        for name, value in elem.attributes.items():
+            text += ' %s=%r' % (name, value)
+
+        if self.node_type == NODE_REFERENCE or not self.children:
+            return text + '/>'
+        return text + '>' + ''.join(child.toxml() for child in self.children) + '</' + elem.tagName + '>'
 
 
 def x3d_parse(path):
@@ -1412,49 +1554,62 @@ def x3d_parse(path):
     Sets up the root node and returns it so load_web3d() can deal with the blender side of things.
     Return root (x3dNode, '') or (None, 'Error String')
     """
-    import xml.dom.minidom
-    import xml.sax
+    import xml.parsers.expat
 
-    '''
-    try:    doc = xml.dom.minidom.parse(path)
-    except: return None, 'Could not parse this X3D file, XML error'
-    '''
+    filehandle = x3dOpen(path)
 
-    # Could add a try/except here, but a console error is more useful.
-    data = gzipOpen(path)
-
-    if data is None:
+    if filehandle is None:
         return None, 'Failed to open file: ' + path
 
-    # Enable line number reporting in the parser - kinda brittle
-    def set_content_handler(dom_handler):
-        def startElementNS(name, tagName, attrs):
-            orig_start_cb(name, tagName, attrs)
-            cur_elem = dom_handler.elementStack[-1]
-            cur_elem.parse_position = (parser._parser.CurrentLineNumber, parser._parser.CurrentColumnNumber)
+    # The file is read in blocks and x3dNode's are made as elements start,
+    # so only one tree is ever built. None on the stack skips an element.
+    parser = xml.parsers.expat.ParserCreate()
+    stack = []
+    roots = []
+
+    def start_element(tagName, attributes):
+        parent = stack[-1] if stack else None
 
-        orig_start_cb = dom_handler.startElementNS
-        dom_handler.startElementNS = startElementNS
-        orig_set_content_handler(dom_handler)
+        if parent is None or parent.node_type == NODE_REFERENCE:
+            if roots or tagName != 'X3D':
+                # Outside the scene, or inside a USE
+                stack.append(None)
+                return
 
-    parser = xml.sax.make_parser()
-    orig_set_content_handler = parser.setContentHandler
-    parser.setContentHandler = set_content_handler
+        element = x3dElement(tagName, attributes, (parser.CurrentLineNumber, parser.CurrentColumnNumber))
 
-    doc = xml.dom.minidom.parseString(data, parser)
+        if parent is None:
+            root = x3dNode(None, NODE_NORMAL, element)
+            root.setRoot(path)  # so images and Inline's we load have a relative path
+            root.lineno = element.parse_position[0]
+            roots.append(root)
+            stack.append(root)
+            return
 
-    try:
-        x3dnode = doc.getElementsByTagName('X3D')[0]
-    except:
+        node_type = NODE_NORMAL
+        if 'USE' in attributes:
+            node_type = NODE_REFERENCE
+
+        child = x3dNode(parent, node_type, element)
+        child.parse()
+        stack.append(child)
+
+    def end_element(tagName):
+        stack.pop()
+
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+
+    # Could add a try/except here, but a console error is more useful.
+    with filehandle:
+        parser.ParseFile(filehandle)
+
+    if not roots:
         return None, 'Not a valid x3d document, cannot import'
 
     bpy.ops.object.select_all(action='DESELECT')
 
-    root = x3dNode(None, NODE_NORMAL, x3dnode)
-    root.setRoot(path)  # so images and Inline's we load have a relative path
-    root.parse()
-
-    return root, ''
+    return roots[0], ''
 
 ## f = open('/_Cylinder.wrl', 'r')
 # f = open('/fe/wrl/Vrml/EGS/TOUCHSN.WRL', 'r')
@@ -1580,19 +1735,45 @@ def translateTexTransform(node, ancestry):
 
     return new_mat
 
+
+# Accumulated Transform matrices keyed by ancestry path, set up by load_web3d.
+# Sibling shapes share their parents' path so each Transform is evaluated once.
+GLOBALS['TRANSFORM_CACHE'] = None
+
+
+def getAncestryMatrix(path, cache):
+    """
+    Return the product of the Transform matrices along path (outermost first).
+    """
+    if not path:
+        return Matrix()
+
+    if cache is not None:
+        mtx = cache.get(path)
+        if mtx is not None:
+            return mtx
+
+    mtx = getAncestryMatrix(path[:-1], cache)
+    node_tx = path[-1]
+    if node_tx.getSpec() == 'Transform':
+        mtx = mtx * translateTransform(node_tx, path[:-1])
+
+    if cache is not None:
+        cache[path] = mtx
+    return mtx
+
+
 def getFinalMatrix(node, mtx, ancestry, global_matrix):
 
-    transform_nodes = [node_tx for node_tx in ancestry if node_tx.getSpec() == 'Transform']
+    path = tuple(ancestry)
     if node.getSpec() == 'Transform':
-        transform_nodes.append(node)
-    transform_nodes.reverse()
+        path += (node,)
 
+    # Never modify the cached matrix, always make a new one
     if mtx is None:
-        mtx = Matrix()
-
-    for node_tx in transform_nodes:
-        mat = translateTransform(node_tx, ancestry)
-        mtx = mat * mtx
+        mtx = getAncestryMatrix(path, GLOBALS['TRANSFORM_CACHE'])
+    else:
+        mtx = getAncestryMatrix(path, GLOBALS['TRANSFORM_CACHE']) * mtx
 
     # worldspace matrix
     mtx = global_matrix * mtx
@@ -2436,6 +2617,60 @@ def importMesh_PointSet(geom, ancestry, _):
 GLOBALS['CIRCLE_DETAIL'] = 96
 
 
+# MolPrint: molecular scenes are thousands of spheres and cylinders that
+# only differ by size and placement. With PRIMITIVE_TEMPLATES set to a dict,
+# they all share one unit mesh per tesselation and carry their size in the
+# object matrix. realizeSharedPrimitives gives every object its own mesh
+# again, MolPrintClean runs it before anything edits the meshes.
+GLOBALS['PRIMITIVE_TEMPLATES'] = None
+
+
+def importMesh_Template(key, make):
+    templates = GLOBALS['PRIMITIVE_TEMPLATES']
+    bpymesh = templates.get(key)
+    if bpymesh is None:
+        bpymesh = templates[key] = make()
+        bpymesh.name = key[0]
+        bpymesh["molprint_template"] = True
+        # Material goes on the object, the slot just has to exist
+        bpymesh.materials.append(None)
+    return bpymesh
+
+
+def importMesh_TemplateScale(geom, geom_spec, ancestry):
+    if geom_spec == 'Sphere':
+        r = geom.getFieldAsFloat('radius', 0.5, ancestry)
+        return (r, r, r)
+    radius, height, top, bottom, side = importMesh_CylinderFields(geom, ancestry)
+    return (radius, height, radius)
+
+
+def realizeSharedPrimitives(objects):
+    # Give every object built on a shared template its own mesh, with the
+    # size moved from the object matrix back into the vertices
+    for bpyob in objects:
+        if bpyob.type != 'MESH' or not bpyob.data.get("molprint_template"):
+            continue
+        bpymesh = bpyob.data
+        if bpymesh.users > 1:
+            bpymesh = bpyob.data = bpymesh.copy()
+        del bpymesh["molprint_template"]
+        bpymesh.name = bpyob.name
+        sx, sy, sz = bpyob["template_scale"]
+        scale = Matrix(((sx, 0, 0, 0), (0, sy, 0, 0), (0, 0, sz, 0), (0, 0, 0, 1)))
+        bpymesh.transform(scale)
+        bpyob.matrix_world = bpyob.matrix_world * scale.inverted()
+        del bpyob["template_scale"]
+        bpymat = bpyob.material_slots[0].material
+        bpyob.material_slots[0].link = 'DATA'
+        bpymesh.materials[0] = bpymat
+        bpymesh.update()
+
+    # Templates nobody uses any more
+    for bpymesh in [me for me in bpy.data.meshes if me.get("molprint_template") and me.users == 0]:
+        bpy.data.meshes.remove(bpymesh)
+
+
 def importMesh_Sphere(geom, ancestry, bpyima):
     # solid is ignored.
     # Extra field 'subdivision="n m"' attribute, specifying how many
@@ -2450,6 +2685,13 @@ def importMesh_Sphere(geom, ancestry, bpyima):
     else:
         nr = ns = GLOBALS['CIRCLE_DETAIL']
         # used as both ring count and segment count
+    if GLOBALS['PRIMITIVE_TEMPLATES'] is not None and not bpyima:
+        return importMesh_Template(('Sphere', nr, ns),
+                                   lambda: importMesh_SphereData(1.0, nr, ns, None))
+    return importMesh_SphereData(r, nr, ns, bpyima)
+
+
+def importMesh_SphereData(r, nr, ns, bpyima):
     lau = pi / nr  # Unit angle of latitude (rings) for the given tesselation
     lou = 2 * pi / ns  # Unit angle of longitude (segments)
 
@@ -2520,10 +2762,7 @@ def importMesh_Sphere(geom, ancestry, bpyima):
     return bpymesh
 
 
-def importMesh_Cylinder(geom, ancestry, bpyima):
-    # solid is ignored
-    # no ccw in this element
-    # Extra parameter subdivision="n" - how many faces to use
+def importMesh_CylinderFields(geom, ancestry):
     radius = geom.getFieldAsFloat('radius', 1.0, ancestry)
     height = geom.getFieldAsFloat('height', 2, ancestry)
     bottom = geom.getFieldAsBool('bottom', True, ancestry)
@@ -2536,10 +2775,23 @@ def importMesh_Cylinder(geom, ancestry, bpyima):
         height = height+0.0005
         bottom = True
         top = True
-    
+    return radius, height, top, bottom, side
+
+
+def importMesh_Cylinder(geom, ancestry, bpyima):
+    # solid is ignored
+    # no ccw in this element
+    # Extra parameter subdivision="n" - how many faces to use
+    radius, height, top, bottom, side = importMesh_CylinderFields(geom, ancestry)
 
     n = geom.getFieldAsInt('subdivision', GLOBALS['CIRCLE_DETAIL'], ancestry)
+    if GLOBALS['PRIMITIVE_TEMPLATES'] is not None and not bpyima:
+        return importMesh_Template(('Cylinder', n, top, bottom, side),
+                                   lambda: importMesh_CylinderData(1.0, 1.0, n, top, bottom, side, None))
+    return importMesh_CylinderData(radius, height, n, top, bottom, side, bpyima)
+
 
+def importMesh_CylinderData(radius, height, n, top, bottom, side, bpyima):
     nn = n * 2
     yvalues = (height / 2, -height / 2)
     angle = 2 * pi / n
@@ -2823,20 +3075,53 @@ def appearance_ExpandCachedMaterial(bpymat):
     return (bpymat, None, False)
 
 
-def appearance_MakeDescCacheKey(material, tex_node):
+def appearance_MakeMaterialKey(mat, ancestry):
+    # Stands in for desc() in VRML: the values appearance_CreateMaterial()
+    # reads, with the same defaults, so equal keys make equal materials.
+    return ('Material',
+            mat.getFieldAsFloat('ambientIntensity', 0.2, ancestry),
+            tuple(mat.getFieldAsFloatTuple('diffuseColor', [0.8, 0.8, 0.8], ancestry)),
+            tuple(mat.getFieldAsFloatTuple('emissiveColor', [0.0, 0.0, 0.0], ancestry)),
+            mat.getFieldAsFloat('shininess', 0.2, ancestry),
+            tuple(mat.getFieldAsFloatTuple('specularColor', [0.0, 0.0, 0.0], ancestry)),
+            mat.getFieldAsFloat('transparency', 0.0, ancestry))
+
+
+def appearance_MakeTextureKey(tex_node, ancestry):
+    # Same for textures: the image source and the wrapping.
+    spec = tex_node.getSpec()
+    if spec == 'ImageTexture':
+        data = tex_node.getFieldName('url', ancestry)
+        # urls are relative to the file they're in
+        origin = os.path.dirname(tex_node.getFilename() or '')
+    else:  # PixelTexture
+        data = tex_node.getFieldAsArray('image', 0, ancestry)
+        origin = None
+
+    if not data:
+        return None
+
+    return (spec,
+            origin,
+            tuple(data),
+            tex_node.getFieldAsBool('repeatS', True, ancestry),
+            tex_node.getFieldAsBool('repeatT', True, ancestry))
+
+
+def appearance_MakeDescCacheKey(material, tex_node, ancestry):
     mat_desc = material.desc() if material else "Default"
     tex_desc = tex_node.desc() if tex_node else "Default"
 
-    if not((tex_node and tex_desc is None) or
-           (material and mat_desc is None)):
-        # desc not available (in VRML)
-        # TODO: serialize VRML nodes!!!
-        return (mat_desc, tex_desc)
-    elif not tex_node and not material:
-        # Even for VRML, we cache the null material
-        return ("Default", "Default")
-    else:
+    # desc not available (in VRML), key on the field values instead.
+    # Molecules have thousands of shapes and a handful of colors.
+    if material and mat_desc is None:
+        mat_desc = appearance_MakeMaterialKey(material, ancestry)
+    if tex_node and tex_desc is None:
+        tex_desc = appearance_MakeTextureKey(tex_node, ancestry)
+
+    if mat_desc is None or tex_desc is None:
         return None  # Desc-based caching is off
+    return (mat_desc, tex_desc)
 
 
 def appearance_Create(vrmlname, material, tex_node, ancestry, node, is_vcol):
@@ -2913,7 +3198,8 @@ def importShape_LoadAppearance(vrmlname, appr, ancestry, node, is_vcol):
     Also, we store textures by description in texture_cache.
 
     Also, we store materials by (material desc, texture desc)
-    in material_cache.
+    in material_cache. VRML nodes have no desc, for them the key is
+    made from the field values.
     """
     # First, check entire-appearance cache
     if appr.reference and appr.getRealNode().parsed:
@@ -2929,7 +3215,7 @@ def importShape_LoadAppearance(vrmlname, appr, ancestry, node, is_vcol):
         return appearance_ExpandCachedMaterial(material.getRealNode().parsed)
 
     # Now the description-based caching
-    cache_key = appearance_MakeDescCacheKey(material, tex_node)
+    cache_key = appearance_MakeDescCacheKey(material, tex_node, ancestry)
 
     if cache_key and cache_key in material_cache:
         bpymat = material_cache[cache_key]
@@ -2995,9 +3281,14 @@ def importShape_ProcessObject(
         global_matrix):
 
     vrmlname += "_" + geom_spec
-    bpydata.name = vrmlname
+    # A shared template keeps its name, its material is set per object below
+    template = type(bpydata) == bpy.types.Mesh and bpydata.get("molprint_template")
+    if not template:
+        bpydata.name = vrmlname
 
-    if type(bpydata) == bpy.types.Mesh:
+    if template:
+        pass
+    elif type(bpydata) == bpy.types.Mesh:
         # solid, as understood by the spec, is always true in Blender
         # solid=false, we don't support it yet.
         creaseAngle = geom.getFieldAsFloat('creaseAngle', None, ancestry)
@@ -3037,6 +3328,12 @@ def importShape_ProcessObject(
     # bpymesh.transform(getFinalMatrix(node))
     bpyob = node.blendObject = bpy.data.objects.new(vrmlname, bpydata)
     bpyob.matrix_world = getFinalMatrix(node, None, ancestry, global_matrix)
+    if template:
+        sx, sy, sz = importMesh_TemplateScale(geom, geom_spec, ancestry)
+        bpyob.matrix_world = bpyob.matrix_world * Matrix(((sx, 0, 0, 0), (0, sy, 0, 0), (0, 0, sz, 0), (0, 0, 0, 1)))
+        bpyob["template_scale"] = (sx, sy, sz)
+        bpyob.material_slots[0].link = 'OBJECT'
+        bpyob.material_slots[0].material = bpymat
     bpyob["ptype"] = geom_spec
     try:
     	bpyob["radius"] = geom.getFieldAsFloat('radius', None, ancestry)
@@ -3096,6 +3393,9 @@ def importShape(bpyscene, node, ancestry, global_matrix):
         bpyob = node.blendData = node.blendObject = bpyob.copy()
         # Could transform data, but better the object so we can instance the data
         bpyob.matrix_world = getFinalMatrix(node, None, ancestry, global_matrix)
+        if "template_scale" in bpyob:
+            sx, sy, sz = bpyob["template_scale"]
+            bpyob.matrix_world = bpyob.matrix_world * Matrix(((sx, 0, 0, 0), (0, sy, 0, 0), (0, 0, sz, 0), (0, 0, 0, 1)))
         bpyscene.objects.link(bpyob).select = True
         return
 
@@ -3470,12 +3770,19 @@ def load_web3d(
         *,
         PREF_FLAT=False,
         PREF_CIRCLE_DIV=16,
+        PREF_SHARED_PRIMITIVES=False,
         global_matrix=None,
         HELPER_FUNC=None
         ):
 
     # Used when adding blender primitives
     GLOBALS['CIRCLE_DETAIL'] = PREF_CIRCLE_DIV
+    GLOBALS['PRIMITIVE_TEMPLATES'] = {} if PREF_SHARED_PRIMITIVES else None
+    GLOBALS['TRANSFORM_CACHE'] = {}
+
+    # Cached datablocks may be gone since the last import
+    texture_cache.clear()
+    material_cache.clear()
 
     #root_node = vrml_parse('/_Cylinder.wrl')
     if filepath.lower().endswith('.x3d'):
@@ -3525,6 +3832,9 @@ def load_web3d(
             translatePositionInterpolator(node, action)
             '''
 
+    # Only valid for this file's nodes
+    GLOBALS['TRANSFORM_CACHE'] = None
+
     # After we import all nodes, route events - anim paths
     for node, ancestry in all_nodes:
         importRoute(node, ancestry)
@@ -3606,6 +3916,7 @@ def load(context,
          filepath,
          *,
          PREF_CIRCLE_DIV=16,
+         PREF_SHARED_PRIMITIVES=True,
          global_matrix=None
          ):
 
@@ -3613,6 +3924,7 @@ def load(context,
     load_web3d(context.scene, filepath,
                PREF_FLAT=True,
                PREF_CIRCLE_DIV=PREF_CIRCLE_DIV,
+               PREF_SHARED_PRIMITIVES=PREF_SHARED_PRIMITIVES,
                global_matrix=global_matrix,
                )
 
@@ -30,10 +30,15 @@ import itertools
 import random
 import time
 import copy
+import os
+import subprocess
+import tempfile
 import addon_utils
 from mathutils.bvhtree import BVHTree
+from mathutils.kdtree import KDTree
 from mathutils import Matrix,Vector
-from collections import Counter
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from decimal import *
 
 def loadpins():
@@ -53,7 +58,7 @@ def bb_size(obj):
    return bbox_v
    
 def makestrut(obj1,obj2):
-    interactionlist = bpy.context.scene.molprint_lists.interactionlist
+    graph = bpy.context.scene.molprint_lists.interactiongraph
     strut_radius = bpy.context.scene.molprint.strut_radius
     dx = obj2.location.x - obj1.location.x
     dy = obj2.location.y - obj1.location.y
@@ -74,14 +79,16 @@ def makestrut(obj1,obj2):
     strut["ptype"] = "Cylinder"
     strut["radius"] = strut_radius
     strut["hbond"] = True
+    #primitive_cylinder_add runs along local Z, imported cylinders along Y
+    strut["localaxis"] = 2
     strut["pinlist"] = ["None"]
     strut["cutcube"] = ['None']
     strut["cone"] = ['None']
     strut["conelist"] = ['None']
-    #Go ahead and update interaction list now
-    if len(interactionlist) > 2:
-        interactionlist.append((obj1,strut))
-        interactionlist.append((obj2,strut))
+    #Go ahead and update interaction graph now
+    if len(graph) > 2:
+        graph.add(obj1.name, strut.name)
+        graph.add(obj2.name, strut.name)
  
 def scalebonds(scale_val):
     for obj in bpy.context.scene.objects:
@@ -91,22 +98,51 @@ def scalebonds(scale_val):
             #reset the radius value
             obj["radius"] = obj["radius"]*scale_val 
 
+def pin_object(name, bm, location, theta, phi):
+    '''Links a new object made from bm, placed and turned like the old bpy.ops primitives'''
+    #Straight data construction, no operator call or scene update per pin
+    scene = bpy.context.scene
+    me = bpy.data.meshes.new(name)
+    bm.to_mesh(me)
+    bm.free()
+    ob = bpy.data.objects.new(name, me)
+    scene.objects.link(ob)
+    ob.layers = scene.layers
+    ob.location = location
+    ob.rotation_euler = (0.0, theta, phi)
+    #New objects only get their world matrix on the next scene update,
+    #the booleans right after need it now
+    ob.matrix_world = Matrix.Translation(location) * ob.rotation_euler.to_matrix().to_4x4()
+    return ob
+
+def pin_cylinder(name, sides, r1, r2, depth, location, theta, phi):
+    '''Cylinder (r1 == r2) or cone along local Z, r1 at the -Z end'''
+    bm = bmesh.new()
+    #diameter1/2 are really radii in bmesh.ops.create_cone
+    bmesh.ops.create_cone(bm, cap_ends=True, cap_tris=False, segments=sides,
+        diameter1=r1, diameter2=r2, depth=depth)
+    return pin_object(name, bm, location, theta, phi)
+
+def pin_box(name, dimensions, location, theta, phi):
+    '''Box with the given dimensions baked into the mesh'''
+    bm = bmesh.new()
+    bmesh.ops.create_cube(bm, size=1.0)
+    bmesh.ops.scale(bm, vec=dimensions, verts=bm.verts)
+    return pin_object(name, bm, location, theta, phi)
+
 def cylinder_between(pair):
-  x2 = pair[1].location.x
-  y2 = pair[1].location.y
-  z2 = pair[1].location.z
-  x1 = pair[0].location.x
-  y1 = pair[0].location.y
-  z1 = pair[0].location.z  
-  dx = x2 - x1
-  dy = y2 - y1
-  dz = z2 - z1    
-  ptb = bpy.context.scene.molprint.pintobond
+  '''Makes the pin for a (sphere, cylinder) pair, returns it'''
+  molprint = bpy.context.scene.molprint
+  loc1 = pair[0].location.copy()
+  loc2 = pair[1].location
+  dx, dy, dz = loc2 - loc1
+  ptb = molprint.pintobond
   dist = get_distance(pair[0],pair[1])
   hbond = pair[1]["hbond"]
   phi = math.atan2(dy, dx) 
   theta = math.acos(dz/dist)
-  split = bpy.context.scene.molprint.splitpins
+  split = molprint.splitpins
+  center = (loc1 + loc2)/2
   if not hbond:
     #If we are doing split pins 
     #First make a cone
@@ -114,32 +150,12 @@ def cylinder_between(pair):
         r1 = pair[1]["radius"]*ptb*0.9
         r2 = pair[1]["radius"]*ptb*1.20
         #Consider doing two cones where cone2 would provide a slight bevel
-        bpy.ops.mesh.primitive_cone_add(vertices=bpy.context.scene.molprint.pin_sides,
-            radius1=r1,
-            radius2=r2, 
-            depth=pair[0]["radius"], 
-            location=pair[0].location
-        )
-        cone1 = bpy.context.scene.objects.active
-        bpy.context.object.rotation_euler[1] = theta 
-        bpy.context.object.rotation_euler[2] = phi
+        cone1 = pin_cylinder("Cone", molprint.pin_sides, r1, r2, pair[0]["radius"], loc1, theta, phi)
         #Cutcube for later differencing, eventually add as user adjustable variable
-        bpy.ops.mesh.primitive_cube_add(radius=r1*0.75, location=pair[0].location)
-        cutcube = bpy.context.scene.objects.active
-        bpy.context.active_object.dimensions = pair[0]["radius"]*1.75, r1*0.55, pair[0]["radius"]*1.45
-        bpy.context.object.rotation_euler[1] = theta 
-        bpy.context.object.rotation_euler[2] = phi
+        cutcube = pin_box("Cube", (pair[0]["radius"]*1.75, r1*0.55, pair[0]["radius"]*1.45), loc1, theta, phi)
   
     r = pair[1]["radius"]*ptb
-    bpy.ops.mesh.primitive_cylinder_add(
-        vertices = bpy.context.scene.molprint.pin_sides,
-        radius = r, 
-        depth = dist,
-        location = (dx/2 + x1, dy/2 + y1, dz/2 + z1)
-    )
-    pin = bpy.context.scene.objects.active
-    bpy.context.object.rotation_euler[1] = theta 
-    bpy.context.object.rotation_euler[2] = phi
+    pin = pin_cylinder("Cylinder", molprint.pin_sides, r, r, dist, center, theta, phi)
     
     if split:
         bool_carve(pin,cone1,'UNION',modapp=True)
@@ -147,19 +163,11 @@ def cylinder_between(pair):
         pin["cutcube"] = [cutcube.name]
         pin["cone"] = [cone1.name]
   else:
-    r = pair[1]["radius"]*bpy.context.scene.molprint.h_pintobond
-    bpy.ops.mesh.primitive_cylinder_add(
-      vertices = bpy.context.scene.molprint.h_pin_sides,
-      radius = r, 
-      depth = dist,
-      location = (dx/2 + x1, dy/2 + y1, dz/2 + z1)   
-    )
-    
-    pin = bpy.context.scene.objects.active
-    bpy.context.object.rotation_euler[1] = theta 
-    bpy.context.object.rotation_euler[2] = phi
+    r = pair[1]["radius"]*molprint.h_pintobond
+    pin = pin_cylinder("Cylinder", molprint.h_pin_sides, r, r, dist, center, theta, phi)
     pin["cutcube"] = ['None']
     pin["cone"] = ['None']
+  return pin
       
 def bmesh_copy_from_object(obj, transform=True, triangulate=True, apply_modifiers=False):
 
@@ -195,18 +203,65 @@ def bmesh_copy_from_object(obj, transform=True, triangulate=True, apply_modifier
 
     return bm
 
+def primitive_shape(obj):
+    '''Returns (center, axis, radius, half height) for imported primitives, None otherwise'''
+    #Radius and height are read from the world dimensions so scaled bonds still work
+    if obj.type != 'MESH' or obj.modifiers:
+        return None
+    ptype = obj.get("ptype")
+    center = obj.matrix_world.to_translation()
+    dims = obj.dimensions
+    if ptype == 'Sphere':
+        return center, None, max(dims)/2, 0.0
+    if ptype == 'Cylinder':
+        #Imported cylinders run along local Y, struts along local Z (see makestrut).
+        #Take the axis from the object matrix, dimensions can't tell a
+        #cylinder as tall as it is wide
+        k = obj.get("localaxis", 1)
+        axis = obj.matrix_world.to_3x3().col[k].normalized()
+        radius = max(dims[(k+1)%3], dims[(k+2)%3])/2
+        return center, axis, radius, dims[k]/2
+    return None
+
+def primitive_check_intersect_objects(obj, obj2):
+    '''Closed form sphere/cylinder contact. Returns None if either is not a primitive'''
+    shape1 = primitive_shape(obj)
+    shape2 = primitive_shape(obj2)
+    if shape1 is None or shape2 is None:
+        return None
+    #Always test the sphere against the other shape
+    if shape1[1] is not None:
+        shape1, shape2 = shape2, shape1
+    if shape1[1] is not None:
+        #Cylinder-cylinder is not needed anywhere, let BVH handle it
+        return None
+    center, _, radius, _ = shape1
+    center2, axis, radius2, halfheight = shape2
+    if axis is None:
+        return (center - center2).length <= radius + radius2
+    #Closest point of a solid cylinder, done in the cylinder axis frame
+    offset = center - center2
+    axial = offset.dot(axis)
+    radial = (offset - axial*axis).length
+    daxial = axial - max(-halfheight, min(halfheight, axial))
+    dradial = radial - min(radial, radius2)
+    return math.sqrt(daxial**2 + dradial**2) <= radius
+
 def bmesh_check_intersect_objects(obj, obj2, selectface=False):
 
     assert(obj != obj2)
+    #Spheres and cylinders are fully described by their transform, skip BVH building
+    if not selectface:
+        intersect = primitive_check_intersect_objects(obj, obj2)
+        if intersect is not None:
+            return intersect
     # Triangulate in most cases, not if using CPK matching
     tris = True
     if selectface:
         tris = False
-    bm = bmesh_copy_from_object(obj, transform=True, triangulate=tris)
-    bm2 = bmesh_copy_from_object(obj2, transform=True, triangulate=tris)
     intersect = False
-    BMT1 = BVHTree.FromBMesh(bm)
-    BMT2 = BVHTree.FromBMesh(bm2)   
+    BMT1 = bvh_from_object(obj, triangulate=tris)
+    BMT2 = bvh_from_object(obj2, triangulate=tris)
     overlap_pairs = BMT1.overlap(BMT2)
 
     if len(overlap_pairs) > 0:
@@ -229,12 +284,70 @@ def bmesh_check_intersect_objects(obj, obj2, selectface=False):
             obj2.data.polygons[each[1]].select = True
             obj2.update_from_editmode()
             
-    bm.free()
-    bm2.free()
-            
     return intersect
 
+#World space BVH trees, most recently used last
+BVH_CACHE_SIZE = 1024
+bvh_cache = OrderedDict()
+
+def bvh_from_object(obj, triangulate=True):
+    '''Returns a world space BVHTree of obj, reused while its transform and mesh are unchanged'''
+    #Edit mode meshes change under us, never cache those
+    if obj.mode == 'EDIT':
+        bm = bmesh_copy_from_object(obj, transform=True, triangulate=triangulate)
+        tree = BVHTree.FromBMesh(bm)
+        bm.free()
+        return tree
+    key = (obj.name, triangulate)
+    stamp = (hash(tuple(tuple(row) for row in obj.matrix_world)), obj.data.as_pointer())
+    cached = bvh_cache.get(key)
+    if cached is not None and cached[0] == stamp:
+        bvh_cache.move_to_end(key)
+        return cached[1]
+    bm = bmesh_copy_from_object(obj, transform=True, triangulate=triangulate)
+    tree = BVHTree.FromBMesh(bm)
+    bm.free()
+    bvh_cache[key] = (stamp, tree)
+    bvh_cache.move_to_end(key)
+    while len(bvh_cache) > BVH_CACHE_SIZE:
+        bvh_cache.popitem(last=False)
+    return tree
+
+def flush_bvh_cache(obj=None):
+    '''Drop cached BVH trees for obj, or for everything if obj is None'''
+    if obj is None:
+        bvh_cache.clear()
+        return
+    for key in [key for key in bvh_cache if key[0] == obj.name]:
+        del bvh_cache[key]
+
+def remove_objects(objects):
+    '''Remove objects and the meshes they leave unused. Returns (objects, meshes) freed'''
+    #One sweep over bpy.data instead of a select/delete operator per object
+    meshes = {}
+    names = set()
+    for ob in objects:
+        try:
+            name = ob.name
+        except ReferenceError:
+            #Already gone
+            continue
+        if name in names:
+            continue
+        names.add(name)
+        flush_bvh_cache(ob)
+        if ob.type == 'MESH':
+            meshes[ob.data.name] = ob.data
+        bpy.data.objects.remove(ob, do_unlink=True)
+    nmeshes = 0
+    for me in meshes.values():
+        if me.users == 0:
+            bpy.data.meshes.remove(me)
+            nmeshes += 1
+    return len(names), nmeshes
+
 def clean_object():
+    flush_bvh_cache(bpy.context.scene.objects.active)
     bpy.ops.object.mode_set(mode='EDIT')
     bpy.ops.mesh.remove_doubles()
     bpy.ops.mesh.select_all(action='DESELECT')
@@ -246,6 +359,251 @@ def clean_object():
 def get_distance(obj1, obj2):
     return  (obj1.location - obj2.location).length
 
+def neighbor_pairs(objects, cutoff):
+    '''Yields object pairs closer than cutoff, in itertools.combinations order'''
+    #KDTree on locations so we never touch pairs that are far apart
+    objlist = list(objects)
+    if not objlist:
+        return
+    kd = KDTree(len(objlist))
+    for i, ob in enumerate(objlist):
+        kd.insert(ob.location, i)
+    kd.balance()
+    for i, ob in enumerate(objlist):
+        near = [j for (co, j, dist) in kd.find_range(ob.location, cutoff) if j > i and dist < cutoff]
+        for j in sorted(near):
+            yield objlist[i], objlist[j]
+
+def quantize(co, step):
+    '''Hashable grid cell of a location'''
+    return tuple(int(round(c/step)) for c in co)
+
+def duplicate_cylinders(objects, step=0.0001):
+    '''Returns cylinders closer than step to an earlier object of any ptype'''
+    #One hashing pass instead of comparing every pair
+    cells = {}
+    duplicates = []
+    for ob in objects:
+        if not ob.get("ptype"):
+            continue
+        key = quantize(ob.location, step)
+        if ob["ptype"] == 'Cylinder':
+            #Neighboring cells too, close centers can straddle a cell border
+            for offset in itertools.product((-1, 0, 1), repeat=3):
+                cell = tuple(k + o for k, o in zip(key, offset))
+                if any((ob.location - other.location).length < step for other in cells.get(cell, ())):
+                    duplicates.append(ob)
+                    break
+        cells.setdefault(key, []).append(ob)
+    return duplicates
+
+class InteractionGraph():
+    '''Bipartite sphere/cylinder contact graph keyed by object name'''
+    #Names rather than objects so the graph survives undo
+    def __init__(self, pairs=()):
+        self.spheres = OrderedDict()
+        self.cylinders = OrderedDict()
+        #Bumped on every change so cached partitions know to rebuild
+        self.version = 0
+        #(sphere, cylinder) -> position in the order contacts were found,
+        #which is the order of the old flat interaction list
+        self.order = {}
+        self.added = 0
+        for sphere, cyl in pairs:
+            self.add(sphere, cyl)
+
+    def __len__(self):
+        return sum(len(cyls) for cyls in self.spheres.values())
+
+    def add(self, sphere, cyl):
+        #Neighbor lists are tiny (bonds per atom), a list check is fine
+        cyls = self.spheres.setdefault(sphere, [])
+        if cyl not in cyls:
+            cyls.append(cyl)
+            self.cylinders.setdefault(cyl, []).append(sphere)
+            self.order[(sphere, cyl)] = self.added
+            self.added += 1
+            self.version += 1
+
+    def neighbors(self, name):
+        '''Cylinders touching a sphere, or spheres touching a cylinder'''
+        if name in self.spheres:
+            return self.spheres[name]
+        return self.cylinders.get(name, [])
+
+    def degree(self, name):
+        return len(self.neighbors(name))
+
+    def second_shell(self, sphere, cyls):
+        '''(sphere, cylinder) contacts of cyls other than sphere, in the order they were found'''
+        edges = [(each, cyl) for cyl in cyls for each in self.cylinders.get(cyl, []) if each != sphere]
+        edges.sort(key=self.order.get)
+        return edges
+
+    def edges(self):
+        '''Yields (sphere, cylinder) name pairs'''
+        for sphere, cyls in self.spheres.items():
+            for cyl in cyls:
+                yield sphere, cyl
+
+    def prune(self, names):
+        '''Forget every object whose name is not in names'''
+        for table, other in ((self.spheres, self.cylinders), (self.cylinders, self.spheres)):
+            for name in [name for name in table if name not in names]:
+                self.version += 1
+                for nb in table.pop(name):
+                    self.order.pop((name, nb) if table is self.spheres else (nb, name), None)
+                    if nb in other and name in other[nb]:
+                        other[nb].remove(name)
+
+class DisjointSet():
+    '''Union-find over object names'''
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def find(self, name):
+        parent = self.parent
+        if name not in parent:
+            parent[name] = name
+            self.size[name] = 1
+            return name
+        #Path halving keeps the trees flat without recursion
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    def union(self, a, b):
+        ra = self.find(a)
+        rb = self.find(b)
+        if ra == rb:
+            return ra
+        if self.size[ra] < self.size[rb]:
+            ra, rb = rb, ra
+        self.parent[rb] = ra
+        self.size[ra] += self.size[rb]
+        return ra
+
+class GroupPartition():
+    '''Components of the interaction graph with selected contacts cut
+
+    Kept between updates so a selection change only merges or splits the
+    components touching objects whose selection state flipped.
+    '''
+    def __init__(self, graph, selected=()):
+        self.graph = graph
+        self.rebuild(selected)
+
+    def rebuild(self, selected):
+        '''Full pass over the graph, needed whenever the graph itself changes'''
+        graph = self.graph
+        self.version = graph.version
+        self.selected = set(selected)
+        self.label = {}
+        self.members = {}
+        self.nextlabel = 0
+        dsu = DisjointSet()
+        for sphere, cyl in graph.edges():
+            if self.iscut(sphere, cyl):
+                dsu.find(sphere)
+                dsu.find(cyl)
+                continue
+            dsu.union(sphere, cyl)
+        roots = {}
+        for name in dsu.parent:
+            root = dsu.find(name)
+            if root not in roots:
+                roots[root] = self.newlabel()
+            self.assign(name, roots[root])
+
+    def iscut(self, a, b):
+        #A selected sphere/cylinder contact is where groups split
+        return a in self.selected and b in self.selected
+
+    def newlabel(self):
+        self.nextlabel += 1
+        self.members[self.nextlabel] = []
+        return self.nextlabel
+
+    def assign(self, name, label):
+        self.label[name] = label
+        self.members[label].append(name)
+
+    def labelof(self, name):
+        #Objects outside the graph (pins, struts not yet added) stand alone
+        if name not in self.label:
+            self.assign(name, self.newlabel())
+        return self.label[name]
+
+    def update(self, selected):
+        '''Bring the partition in line with a new selection'''
+        selected = set(selected)
+        if self.version != self.graph.version:
+            self.rebuild(selected)
+            return
+        old = self.selected
+        self.selected = selected
+        joined = []
+        cut = []
+        for name in old ^ selected:
+            self.labelof(name)
+            for nb in self.graph.neighbors(name):
+                wascut = name in old and nb in old
+                if self.iscut(name, nb) and not wascut:
+                    cut.append(name)
+                elif wascut and not self.iscut(name, nb):
+                    joined.append((name, nb))
+        for a, b in joined:
+            self.merge(self.label[a], self.label[b])
+        for label in {self.label[name] for name in cut}:
+            self.split(label)
+
+    def merge(self, la, lb):
+        if la == lb:
+            return
+        #Relabel the smaller side
+        if len(self.members[la]) < len(self.members[lb]):
+            la, lb = lb, la
+        for name in self.members[lb]:
+            self.label[name] = la
+        self.members[la].extend(self.members.pop(lb))
+
+    def split(self, label):
+        '''Re-walk one component after some of its contacts were cut'''
+        members = self.members.pop(label)
+        seen = set()
+        for seed in members:
+            if seed in seen:
+                continue
+            newlabel = self.newlabel()
+            seen.add(seed)
+            queue = [seed]
+            for name in queue:
+                self.assign(name, newlabel)
+                for nb in self.graph.neighbors(name):
+                    if nb in seen or self.iscut(name, nb):
+                        continue
+                    seen.add(nb)
+                    queue.append(nb)
+
+    def groups(self, selected):
+        '''Returns (groups, name->group index) for components holding a selected object
+
+        Groups come in selection order, each starting with the selected
+        object that seeded it. The other members follow the partition's
+        insertion order, not the order the old breadth first walk used.
+        '''
+        groups = []
+        index = {}
+        for name in selected:
+            label = self.labelof(name)
+            if label not in index:
+                index[label] = len(groups)
+                groups.append([name] + [each for each in self.members[label] if each != name])
+        groupmap = {name: i for i, group in enumerate(groups) for name in group}
+        return groups, groupmap
+
 #This is needed for older pymol vrml versions which added lots of extra primitive spheres
 def isinside(obj1,obj2):
     #This is messy, but works reasonably well
@@ -292,64 +650,29 @@ def updategroups():
         return
     #Sadly, must do this every time to avoid errors arising from undo
     bpy.ops.mesh.molprint_objinteract()    
-    grouplist = []
-    bpy.context.scene.molprint_lists.grouplist = []
-    interaction_list = bpy.context.scene.molprint_lists.interactionlist
-   
+    graph = bpy.context.scene.molprint_lists.interactiongraph
+    partition = bpy.context.scene.molprint_lists.partition
     #Run for each object that is selected in scene
-    for each in (bpy.context.selected_objects):
-        group = []
-        #checks to see if the object is already part of a group
-        if each in itertools.chain.from_iterable(grouplist):
-            continue
-        #determine if our current/next interaction will be cylinder of sphere. Must always alternate in this case, i.e. no sphere-sphere contacts
-        if each["ptype"] == 'Sphere':
-             i,j = 0,1 
-        if each["ptype"] == 'Cylinder':
-             i,j = 1,0 
-        #This object defines the first member of a new group
-        group.append(each)
-        #This is a list of all interacters that we need to branch from for defining the group
-        nextlist = [value[j] for value in interaction_list if value[i] == each and value[j] not in bpy.context.selected_objects]
-        additions = True
-        
-        while additions:
-            additionlist = []
-            additions = False
-            for nextobj in nextlist:
-                group.append(nextobj)
-                objinteract = [obj[i] for obj in interaction_list if obj[j] == nextobj]
-                #print("Object inteaction list:", objinteract)
-                for nexts in objinteract:
-                    if nexts in group:
-                        continue
-                    if nextobj["ptype"] == 'Sphere' and nextobj in bpy.context.selected_objects and nexts in bpy.context.selected_objects:
-                        continue
-                    if nextobj["ptype"] == 'Cylinder' and nextobj in bpy.context.selected_objects and nexts in bpy.context.selected_objects:
-                        continue
-                    
-                    additionlist.append(nexts)
-
-            nextlist = []
-            nextlist = additionlist 
-            if len(nextlist) > 0:
-                additions = True
-            if i == 1:
-                i,j = 0,1
-            else:
-                i,j = 1,0        
-        grouplist.append(group)
+    selected = [ob.name for ob in bpy.context.selected_objects]
+    if partition is None or partition.graph is not graph:
+        partition = GroupPartition(graph, selected)
+        bpy.context.scene.molprint_lists.partition = partition
+    else:
+        partition.update(selected)
+    groups, groupmap = partition.groups(selected)
+    #One pass to map names, scene.objects lookups by name are not cheap
+    objects = {ob.name: ob for ob in bpy.context.scene.objects}
+    grouplist = [[objects[name] for name in group] for group in groups]
 
+    bpy.context.scene.molprint_lists.groupmap = groupmap
     bpy.context.scene.molprint_lists.grouplist = grouplist
     #This updates materials - useful for small things, but might slow things down for bigger stuff   
-    colors = material_colors(grouplist) 
-    #Is creating materials each time a waste of resources? Probably    
+    #Palette materials are reused, only objects changing color are touched
     m = 0
     for each in grouplist:
-        mat = makeMaterial('mat'+str(m),colors[m])
+        mat = palette_material(m)
         for ob in each:    
-            ob.data.materials.clear()
-            ob.data.materials.append(mat)
+            assign_material(ob, mat)
         m += 1
       
     #end = time.time()
@@ -363,6 +686,23 @@ def makeMaterial(name, diffuse):
     mat.diffuse_intensity = 1.0 
     return mat
 
+def palette_material(index):
+    '''Material for a palette color index, created once and then reused'''
+    name = 'molprint_mat'+str(index)
+    mat = bpy.data.materials.get(name)
+    if mat is None:
+        colors = material_colors(range(index))
+        mat = makeMaterial(name, colors[index])
+    return mat
+
+def assign_material(ob, mat):
+    '''Make mat the only material of ob, skipping objects that already have it'''
+    mats = ob.data.materials
+    if len(mats) == 1 and mats[0] == mat:
+        return
+    mats.clear()
+    mats.append(mat)
+
 def material_colors(thelist):
     color_num = 0
     i = 1.0
@@ -382,14 +722,12 @@ def material_colors(thelist):
 def color_by_radius():
     '''Color every object in the model by radius value'''
     unique = radius_sort(bpy.context.scene.objects)
-    colors = material_colors(bpy.context.scene.objects)
     
     m = 0
     for each in unique:
-        mat = makeMaterial('mat'+str(m),colors[m])
+        mat = palette_material(m)
         for ob in each:    
-            ob.data.materials.clear()
-            ob.data.materials.append(mat)
+            assign_material(ob, mat)
         m += 1
 
 #No longer used.            
@@ -424,6 +762,7 @@ def bool_carve(obj1,obj2,booltype,modapp=False):
     if modapp:
         bpy.context.scene.objects.active = obj1
         bpy.ops.object.modifier_apply (modifier='simpmod')
+        flush_bvh_cache(obj1)
     
 
 def bool_bmesh(obj1,obj2,booltype,modapp=False):
@@ -435,6 +774,53 @@ def bool_bmesh(obj1,obj2,booltype,modapp=False):
     if modapp:
         bpy.context.scene.objects.active = obj1
         bpy.ops.object.modifier_apply (modifier='simpmod')
+        flush_bvh_cache(obj1)
+
+def merged_cutter(objects):
+    '''New object holding the world space geometry of all objects'''
+    bm = bmesh.new()
+    for ob in objects:
+        other = bmesh.new()
+        other.from_mesh(ob.data)
+        bmesh_append(bm, other, ob.matrix_world)
+        other.free()
+    me = bpy.data.meshes.new("molprint_cutter")
+    bm.to_mesh(me)
+    bm.free()
+    cutter = bpy.data.objects.new("molprint_cutter", me)
+    bpy.context.scene.objects.link(cutter)
+    return cutter
+
+def cutters_overlap(cutters, tol=1e-4):
+    '''True if the world bounding spheres of any two cutters overlap or touch'''
+    bounds = []
+    for ob in cutters:
+        center = ob.matrix_world * (sum((Vector(c) for c in ob.bound_box), Vector()) / 8)
+        bounds.append((center, ob.dimensions.length / 2))
+    for (c1, r1), (c2, r2) in itertools.combinations(bounds, 2):
+        if (c1 - c2).length <= r1 + r2 + tol:
+            return True
+    return False
+
+def bool_batch(obj,cutters,booltype,carve=False):
+    '''One boolean of obj with all cutters at once, instead of a modifier_apply per cutter'''
+    if not cutters:
+        return
+    #A merged cutter with overlapping shells or coincident caps gives a
+    #non-manifold operand, so those go through one boolean each
+    if len(cutters) == 1 or cutters_overlap(cutters):
+        for cutter in cutters:
+            if carve:
+                bool_carve(obj,cutter,booltype,modapp=True)
+            else:
+                bool_bmesh(obj,cutter,booltype,modapp=True)
+        return
+    cutter = merged_cutter(cutters)
+    if carve:
+        bool_carve(obj,cutter,booltype,modapp=True)
+    else:
+        bool_bmesh(obj,cutter,booltype,modapp=True)
+    remove_objects([cutter])
 
 def radius_sort(tosort):
 #Create list that contains all objects by radius. Tosort is the list to sort from
@@ -449,8 +835,9 @@ def radius_sort(tosort):
 def joinall():
     '''Join and apply pins to different groups'''
     updategroups()
+    graph = bpy.context.scene.molprint_lists.interactiongraph
     cylinders = []
-    spheres = []
+    spheres = {}
     pairs = []
     #Turn these off so it isn't constantly trying to update
     bpy.context.scene.molprint.interact = False
@@ -463,26 +850,29 @@ def joinall():
             cylinders.append(ob)
 
         if ob.type == 'MESH' and ob["ptype"] == 'Sphere':
-            spheres.append(ob)
-         
+            spheres[ob.name] = ob
+    
+    #Contacts were found by get interactions (and updategroups pruned them),
+    #so pin pairs are just the graph edges between selected objects
     for cyl in cylinders:
-        intersect = False
-        for sphere in spheres:
-            intersect = bmesh_check_intersect_objects(sphere, cyl)
-            if intersect:
+        for name in graph.neighbors(cyl.name):
+            sphere = spheres.get(name)
+            if sphere is not None:
                 pairs.append((sphere,cyl))
                 
     #Sanity check to make sure pairs are in different groups, otherwise things explode
-    for pair in pairs:
-        p1group = next(((i) for i, group in enumerate(bpy.context.scene.molprint_lists.grouplist) if pair[0] in group), None)
-        p2group = next(((i) for i, group in enumerate(bpy.context.scene.molprint_lists.grouplist) if pair[1] in group), None)
-        #print(p1group,p2group)
-        if p1group == p2group:
-            pairs.remove(pair)
+    #groupmap is name -> group index, published by updategroups with grouplist
+    groupmap = bpy.context.scene.molprint_lists.groupmap
+    pairs = [pair for pair in pairs if groupmap.get(pair[0].name) != groupmap.get(pair[1].name)]
             
+    #Booleans are batched per cylinder: all its spheres in one DIFFERENCE,
+    #then all its pins in one UNION
+    targets = OrderedDict()
+    for sphere, cyl in pairs:
+        targets.setdefault(cyl.name, (cyl, [], []))[1].append(sphere)
     #For print-in-place bonds, will need to up-scale sphere and then do carve or parts will be touching               
-    for each in pairs:
-        bool_bmesh(each[1],each[0],'DIFFERENCE',modapp=True)
+    for cyl, cutters, pins in targets.values():
+        bool_batch(cyl,cutters,'DIFFERENCE')
             
     pinlist = []
     conelist = []
@@ -490,9 +880,8 @@ def joinall():
     
     for each in pairs:
         #Make pin objects and give them a specific ptype   
-        cylinder_between(each)
+        pin = cylinder_between(each)
         #put the sphere and the pin cylinder into a list
-        pin = bpy.context.scene.objects.active
         pin["ptype"] = 'pin'
         #Are these lists used for anything? check
         #pinlist.append(pin)
@@ -501,10 +890,13 @@ def joinall():
         if bpy.context.scene.molprint.splitpins:
             each[0]["conelist"] += pin["cone"]
             each[1]["cutcube"] += pin["cutcube"]
-        #union cylinder and pin if normal mode
-        bool_bmesh(each[1],pin,'UNION',modapp=True)
-        bpy.ops.object.select_all(action='DESELECT')
-    #TODO: Put each group into a thread to speed things up?   
+        targets[each[1].name][2].append(pin)
+    #union cylinder and pins if normal mode
+    for cyl, cutters, pins in targets.values():
+        bool_batch(cyl,pins,'UNION')
+    bpy.ops.object.select_all(action='DESELECT')
+    #Joined groups waiting for their intersect and pin booleans
+    joined = []
     for group in bpy.context.scene.molprint_lists.grouplist:
         bpy.ops.object.select_all(action='DESELECT')
         pins = []
@@ -599,20 +991,87 @@ def joinall():
             #print(pins)
             bpy.ops.object.join()
             bpy.ops.object.origin_set(type='ORIGIN_CENTER_OF_MASS')
-            mat = group[0].data.materials[0]
-            newcube = intersect_pin(group[0])            
-            newcube.data.materials.append(mat)
-            #Do these if we are doing split pins
-            if bpy.context.scene.molprint.splitpins:
-                difference_pin(newcube,newcube["pinlist"],doscale=False,carve=True)
-                difference_pin(newcube,newcube["conelist"])
-                difference_pin(newcube,newcube["cutcube"],doscale=False,carve=True)
-            else:
-                difference_pin(newcube,newcube["pinlist"],carve=True)
-            clean_object()    
+            joined.append(group[0])
+    #Groups share nothing once joined (each pin belongs to one pinlist),
+    #so their booleans can run side by side in background processes
+    splitpins = bpy.context.scene.molprint.splitpins
+    pinscale = bpy.context.scene.molprint.pinscale
+    if joined and bpy.context.scene.molprint.parallel_groups:
+        joined = finish_groups_parallel(joined, splitpins, pinscale, bpy.context.scene.molprint.group_workers)
+    for ob in joined:
+        finish_group(ob, splitpins, pinscale)
+    #Joined objects keep their names but not their geometry
+    flush_bvh_cache()
     if bpy.context.scene.molprint.multicolor:
         color_by_radius()
         
+def finish_group(ob, splitpins, pinscale):
+    '''Intersect a joined group into one solid and cut its pin holes, returns the new object'''
+    #Settings are passed in, pin_worker.py runs this without the addon registered
+    mat = ob.data.materials[0]
+    newcube = intersect_pin(ob)            
+    newcube.data.materials.append(mat)
+    #Do these if we are doing split pins
+    if splitpins:
+        difference_pin(newcube,newcube["pinlist"],doscale=False,carve=True,pinscale=pinscale)
+        difference_pin(newcube,newcube["conelist"],pinscale=pinscale)
+        difference_pin(newcube,newcube["cutcube"],doscale=False,carve=True,pinscale=pinscale)
+    else:
+        difference_pin(newcube,newcube["pinlist"],carve=True,pinscale=pinscale)
+    clean_object()
+    return newcube
+
+def group_cutters(ob):
+    '''Names of the pins, cones and cut cubes a joined group will be differenced with'''
+    names = []
+    for key in ("pinlist", "conelist", "cutcube"):
+        names += [value for value in ob[key] if value != 'None']
+    return names
+
+def finish_groups_parallel(obs, splitpins, pinscale, workers=0):
+    '''Runs finish_group for each joined group in a background Blender, returns the groups that failed'''
+    #bpy is not thread safe, so each group goes to its own process as a .blend
+    #work package, and the threads here only wait on those processes
+    scene = bpy.context.scene
+    worker = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pin_worker.py")
+    failed = []
+    with tempfile.TemporaryDirectory(prefix="molprint_") as workdir:
+        jobs = []
+        for i, ob in enumerate(obs):
+            cutters = [scene.objects[name] for name in group_cutters(ob) if name in scene.objects]
+            package = os.path.join(workdir, "group%d.blend" % i)
+            result = os.path.join(workdir, "result%d.blend" % i)
+            log = os.path.join(workdir, "group%d.log" % i)
+            bpy.data.libraries.write(package, set([ob] + cutters), fake_user=True)
+            cmd = [bpy.app.binary_path, "-b", "--factory-startup", "--python", worker, "--",
+                   package, result, ob.name, repr(pinscale), "1" if splitpins else "0"]
+            jobs.append((ob, cutters, result, log, cmd))
+
+        def run(job):
+            with open(job[3], 'w') as log:
+                return subprocess.call(job[4], stdout=log, stderr=subprocess.STDOUT)
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            codes = list(pool.map(run, jobs))
+
+        for (ob, cutters, result, log, cmd), code in zip(jobs, codes):
+            #The worker only writes a result when it got all the way through
+            if code != 0 or not os.path.exists(result):
+                print("Group", ob.name, "failed in the background, finishing it here. Worker output:")
+                with open(log, errors='replace') as f:
+                    print(f.read())
+                failed.append(ob)
+                continue
+            with bpy.data.libraries.load(result) as (data_from, data_to):
+                data_to.objects = data_from.objects
+            newcube = data_to.objects[0]
+            scene.objects.link(newcube)
+            #Materials are left out of the result so the palette isn't duplicated
+            newcube.data.materials.append(ob.data.materials[0])
+            remove_objects([ob] + cutters)
+    bpy.ops.object.select_all(action='DESELECT')
+    return failed
+
 def intersect_pin(ob):
     #print(ob)
     #start = time.time()
@@ -620,8 +1079,11 @@ def intersect_pin(ob):
     conelist = []
     cutcubelist = []
     bpy.ops.mesh.primitive_cube_add(location=(ob.location))
-    bpy.ops.transform.resize(value=(30, 30, 30))
     cube = bpy.context.selected_objects[0]
+    #Same as resizing the new cube, without needing a 3D view (background workers)
+    cube.scale = (30, 30, 30)
+    #The INTERSECT below reads the world matrix, which only follows the scale on the next scene update
+    cube.matrix_world = cube.matrix_basis.copy()
     cube["ptype"] = 'newcube'
     pinlist[:] = (value for value in ob["pinlist"] if value != 'None')
     cube["pinlist"] = pinlist
@@ -639,8 +1101,9 @@ def intersect_pin(ob):
     #print("Intersect unionization time:",end-start)
     return cube
     
-def difference_pin(obj,thelist,doscale=True,carve=False):
-    pinscale = bpy.context.scene.molprint.pinscale
+def difference_pin(obj,thelist,doscale=True,carve=False,pinscale=None):
+    if pinscale is None:
+        pinscale = bpy.context.scene.molprint.pinscale
     if len(thelist) > 0:
         bpy.ops.object.select_all(action='DESELECT')
         
@@ -664,99 +1127,98 @@ def difference_pin(obj,thelist,doscale=True,carve=False):
 
 def select_hbonds():
     '''Selects cylinders below max_hbond as hydrogen bonds'''
-    interaction_list = bpy.context.scene.molprint_lists.interactionlist
-    for each in interaction_list:
+    graph = bpy.context.scene.molprint_lists.interactiongraph
+    objects = bpy.context.scene.objects
+    for cylname, spheres in graph.cylinders.items():
+        cyl = objects[cylname]
         #Reset in case radius value has been changed, won't deselect however
-        each[1]["hbond"] = 0
-        if each[1]["radius"] <= bpy.context.scene.molprint.max_hbond:
-            each[0].select = True
-            each[1].select = True
-            each[1]["hbond"] = 1
+        cyl["hbond"] = 0
+        if cyl["radius"] <= bpy.context.scene.molprint.max_hbond:
+            for sphere in spheres:
+                objects[sphere].select = True
+            cyl.select = True
+            cyl["hbond"] = 1
 
 #Pure nastiness, but couldn't figure out a nicer way initially.
 def select_phosphate(context):
     '''Select Phosphates based on atom radius'''
-    interaction_list = bpy.context.scene.molprint_lists.interactionlist
-    countdictsphere = Counter(elem[0] for elem in interaction_list)
+    graph = bpy.context.scene.molprint_lists.interactiongraph
+    objects = bpy.context.scene.objects
     
-    for k, v in countdictsphere.items():
+    for k, kcyls in graph.spheres.items():
+        sphere = objects[k]
         #is it a phosphorous?
-        if v == 4 and abs(k["radius"] - bpy.context.scene.molprint.phosphorous_radius) < 0.0001:
-            k.select = True
+        if len(kcyls) == 4 and abs(sphere["radius"] - bpy.context.scene.molprint.phosphorous_radius) < 0.0001:
+            sphere.select = True
             fin = False
-            cyls = [value[1] for value in interaction_list if value[0] == k and not value[1]["hbond"]]
+            cyls = [value for value in kcyls if not objects[value]["hbond"]]
             for cyl in cyls:
                 if fin:
                     break
-                second_sphere = [each[0] for each in interaction_list if each[0] != k and each[1] == cyl]
+                second_sphere = [each for each in graph.cylinders[cyl] if each != k]
                 for ss in second_sphere:
-                    second_cyl = [each[1] for each in interaction_list if ss == each[0] and each[1] not in cyls]
+                    second_cyl = [each for each in graph.spheres[ss] if each not in cyls]
                     
                     for sc in second_cyl:
-                        third_sphere = [each[0] for each in interaction_list if sc == each[1] and each[0] != ss]
+                        third_sphere = [each for each in graph.cylinders[sc] if each != ss]
                         
-                        for k1, v1 in countdictsphere.items():
-                            if k1 == third_sphere[0] and v1 > 2:
-                                cyl.select = True
-                                fin = True
-                                break
+                        if third_sphere and graph.degree(third_sphere[0]) > 2:
+                            objects[cyl].select = True
+                            fin = True
                             
 def select_glyco_na(context):
     '''Select glycosidic bond of nucleic acids.'''
-    interaction_list = bpy.context.scene.molprint_lists.interactionlist
-    countdict = Counter(elem[0] for elem in interaction_list)
+    graph = bpy.context.scene.molprint_lists.interactiongraph
+    objects = bpy.context.scene.objects
     rads = (round(bpy.context.scene.molprint.carbon_radius,3),round(bpy.context.scene.molprint.nitrogen_radius,3),round(bpy.context.scene.molprint.oxygen_radius,3))
-    for k, v in countdict.items():
-        if v == 3 and k["radius"] == round(bpy.context.scene.molprint.carbon_radius,3):
+    for k, kcyls in graph.spheres.items():
+        if len(kcyls) == 3 and objects[k]["radius"] == round(bpy.context.scene.molprint.carbon_radius,3):
             #first get all cylinders connected, ignoring H-bonds
-            cyls = [value[1] for value in interaction_list if value[0] == k and not value[1]["hbond"]]
-            second = [each for each in interaction_list if each[0] != k and each[1] in cyls]
+            cyls = [value for value in kcyls if not objects[value]["hbond"]]
+            #Order matters, second[1] is picked below
+            second = [(objects[each], objects[cyl]) for each, cyl in graph.second_shell(k, cyls)]
+            if len(second) < 3:
+                continue
             dist1 = get_distance(second[0][0],second[1][0])
             dist2 = get_distance(second[0][0],second[2][0])
             dist3 = get_distance(second[1][0],second[2][0])
             avgdist = dist1+dist2+dist3/3
             secondrads = (round(second[0][0]["radius"],3),round(second[1][0]["radius"],3),round(second[2][0]["radius"],3))
             #This is problematic. Works well with Pymol files, not as well with Chimera
-            if rads == secondrads and avgdist > 5.56 and countdict.get(second[1][0]) > 1:
-                k.select = True
+            if rads == secondrads and avgdist > 5.56 and graph.degree(second[1][0].name) > 1:
+                objects[k].select = True
                 second[1][1].select = True
 
 #Meant for protein selection. Actually selects C-alphas.
 def select_amides(context):
     '''Select alpha carbon (even though it say amide)'''
-    interaction_list = bpy.context.scene.molprint_lists.interactionlist
-    countdict = Counter(elem[0] for elem in interaction_list)
-    #print(countdict)
+    graph = bpy.context.scene.molprint_lists.interactiongraph
+    objects = bpy.context.scene.objects
     #TODO: assign element variable to radius so this doesn't have to be hardcoded
     rads = (round(bpy.context.scene.molprint.carbon_radius,3),
             round(bpy.context.scene.molprint.nitrogen_radius,3),
             round(bpy.context.scene.molprint.oxygen_radius,3))
-    for k, v in countdict.items():
-        if v == 3 and k["radius"] == round(bpy.context.scene.molprint.carbon_radius,3):
+    for k, kcyls in graph.spheres.items():
+        if len(kcyls) == 3 and objects[k]["radius"] == round(bpy.context.scene.molprint.carbon_radius,3):
             #first get all cylinders connected, ignoring H-bonds
-            #print(k)
-            cyls = [value[1] for value in interaction_list if value[0] == k and value[1]["radius"] > bpy.context.scene.molprint.max_hbond]
+            cyls = [value for value in kcyls if objects[value]["radius"] > bpy.context.scene.molprint.max_hbond]
             if len(cyls) != 3:
                 continue
-            #print(cyls)
             #now get sphere,cylinders that are not the original
-            second = [each for each in interaction_list if each[0] != k and each[1] in cyls]
+            second = [(objects[each], objects[cyl]) for each, cyl in graph.second_shell(k, cyls)]
             if len(second) != 3:
                 continue
-            #print(second)
             secondrads = (round(second[0][0]["radius"],3),round(second[1][0]["radius"],3),round(second[2][0]["radius"],3))
             rads = sorted(rads)
             secondrads = sorted(secondrads)
-            #print(rads,secondrads)
             if rads == secondrads:
                 #Select nitrogen to get its bond, but it is actually better to select our alpha
                 nitrogen = next(value for value in second if round(value[0]["radius"],3) == round(bpy.context.scene.molprint.nitrogen_radius,3))
                 alpha = next(value for value in second if round(value[0]["radius"],3) == round(bpy.context.scene.molprint.carbon_radius,3))
                 #need to differentiate backbone from Asn/Gln
-                if countdict.get(nitrogen[0]) > 1:                 
+                if graph.degree(nitrogen[0].name) > 1:                 
                     alpha[0].select = True
                     alpha[1].select = True
-                    #k.select = True
                     
 def floorall(context):
     '''Place largest convex hull face orthogonal to Z'''
@@ -818,35 +1280,112 @@ def align_vector(obj,vec1,vec2):
     matrix_translation = Matrix.Translation(matrix_orig.to_translation())
     obj.matrix_world = matrix_translation * matrix_rotate.to_4x4()
 
-def check_split_cyls(obj1,obj2,splitcyllist):
-    '''PyMol splits all cylinders. This joins them together'''
-    bpy.ops.object.select_all(action='DESELECT') 
-    bm1 = bmesh_copy_from_object(obj1, transform=True, triangulate=False)
-    bm2 = bmesh_copy_from_object(obj2, transform=True, triangulate=False)
-    matched = False
-    #Must also check face normals
-    for f1 in bm1.faces:
-        if matched:
-            break
-        if len(f1.edges) > 4:
-            f1.normal_flip()
-            for f2 in bm2.faces:
-                if len(f2.edges) > 4:
-                    fnorm1 = (f1.normal * obj1.matrix_world).to_tuple(3)
-                    fnorm2 = (f2.normal * obj2.matrix_world).to_tuple(3)
-                    #convert these to a tuple to allow comparision without rounding issues of vectors
-                    #only need one check. For chimera, needed to drop precision down to 3
-                    if tol(f1.calc_center_median(),f2.calc_center_median()) and fnorm1[1] == fnorm2[1]:
-                        matched = True
-                        splitcyllist.append((obj1,obj2))
-                        break
-    bm1.free()
-    bm2.free()
+def cylinder_endpoints(obj):
+    '''World space centers of both caps of an imported cylinder (local Y axis)'''
+    box = obj.bound_box
+    xs = [corner[0] for corner in box]
+    ys = [corner[1] for corner in box]
+    zs = [corner[2] for corner in box]
+    x = (max(xs) + min(xs))/2
+    z = (max(zs) + min(zs))/2
+    return obj.matrix_world * Vector((x, max(ys), z)), obj.matrix_world * Vector((x, min(ys), z))
+
+def split_cyl_pairs(objects, step=0.01):
+    '''PyMol splits all cylinders. Pairs up halves that share a cap and an axis'''
+    #Cap centers are hashed on a grid, so every half-bond is visited once
+    cells = {}
+    ends = []
+    for ob in objects:
+        if ob.get("ptype") != 'Cylinder':
+            continue
+        p1, p2 = cylinder_endpoints(ob)
+        if (p1 - p2).length == 0:
+            continue
+        axis = (p1 - p2).normalized()
+        for point in (p1, p2):
+            end = (ob, point, axis)
+            ends.append(end)
+            cells.setdefault(quantize(point, step), []).append(end)
+    splitcyllist = []
+    used = set()
+    for ob, point, axis in ends:
+        if ob.name in used:
+            continue
+        key = quantize(point, step)
+        #Neighboring cells too, a shared cap can straddle a cell border
+        for offset in itertools.product((-1, 0, 1), repeat=3):
+            cell = tuple(k + o for k, o in zip(key, offset))
+            for other, opoint, oaxis in cells.get(cell, ()):
+                if other.name == ob.name or other.name in used:
+                    continue
+                if (point - opoint).length < step and abs(axis.dot(oaxis)) > 0.999:
+                    splitcyllist.append((ob, other))
+                    used.add(ob.name)
+                    used.add(other.name)
+                    break
+            if ob.name in used:
+                break
     return splitcyllist
 
+def bmesh_append(bm, other, matrix):
+    '''Copy the geometry of bmesh other into bm, transformed by matrix. Returns the new verts, in other's order'''
+    other.verts.index_update()
+    verts = [bm.verts.new(matrix * v.co) for v in other.verts]
+    for f in other.faces:
+        face = bm.faces.new([verts[v.index] for v in f.verts])
+        face.smooth = f.smooth
+        face.material_index = f.material_index
+    return verts
+
+def cap_faces(bm):
+    return [f for f in bm.faces if len(f.verts) > 4]
+
+def merge_split_pair(a, b, dist=0.01):
+    '''Weld the half-cylinder b onto a at the mesh level, a keeps the result'''
+    bm = bmesh.new()
+    bm.from_mesh(a.data)
+    bm2 = bmesh.new()
+    bm2.from_mesh(b.data)
+    bm2.verts.index_update()
+    #Work in the local space of a
+    matrix = a.matrix_world.inverted() * b.matrix_world
+    #The two caps closest to each other are the shared ones
+    caps = [(fa, fb) for fa in cap_faces(bm) for fb in cap_faces(bm2)]
+    ring = {}
+    if caps:
+        fa, fb = min(caps, key=lambda pair: (pair[0].calc_center_median() - matrix * pair[1].calc_center_median()).length)
+        #Each ring vert of b to its closest ring vert of a
+        for vb in fb.verts:
+            co = matrix * vb.co
+            va = min(fa.verts, key=lambda v: (v.co - co).length)
+            if (va.co - co).length < dist:
+                ring[vb.index] = va
+        #Only open the caps if their rings line up one to one, otherwise keep two closed shells
+        if len(fa.verts) != len(fb.verts) or len(ring) != len(fb.verts) or len(set(ring.values())) != len(ring):
+            ring = {}
+    if ring:
+        bm.faces.remove(fa)
+        bm2.faces.remove(fb)
+    verts = bmesh_append(bm, bm2, matrix)
+    bm2.free()
+    if ring:
+        #Only the matched ring verts are merged, thin cylinders keep their own rings
+        bmesh.ops.weld_verts(bm, targetmap={verts[index]: va for index, va in ring.items()})
+        #Same as the dissolve_limited operator default
+        bmesh.ops.dissolve_limit(bm, angle_limit=math.radians(5), verts=bm.verts, edges=bm.edges)
+    #Origin to the area weighted center, like ORIGIN_CENTER_OF_MASS
+    area = sum(f.calc_area() for f in bm.faces)
+    if area > 0:
+        center = sum((f.calc_center_median()*f.calc_area() for f in bm.faces), Vector()) / area
+        bm.transform(Matrix.Translation(-center))
+        a.matrix_world = a.matrix_world * Matrix.Translation(center)
+    bm.to_mesh(a.data)
+    bm.free()
+    a.data.update()
+
 def merge_split_cyls(splitcyllist):
-    #looked into doing this with bmesh, but wasn't as straightforward :(
-    #print(splitcyllist)
+    '''Merge matched half-cylinders without going through join/edit mode operators'''
+    merged = []
     for a,b in splitcyllist:
         #Some models can have odd organization that leads to failures. Try to fix with a quick check:
         try:
@@ -854,23 +1393,12 @@ def merge_split_cyls(splitcyllist):
             b.data.materials.clear()
         except:
             continue
-        bpy.ops.object.select_all(action='DESELECT')
-        bpy.context.scene.objects.active = a
-        a.select = True
-        b.select = True
-        bpy.ops.object.join()
-        #Remove interior faces, limited dissolve
-        bpy.context.scene.objects.active = a
-        a.select
-        clean_object()
+        merge_split_pair(a, b)
+        flush_bvh_cache(a)
+        merged.append(b)
+    #The halves that were folded in go away in one sweep
+    remove_objects(merged)
         
-        bpy.ops.object.origin_set(type='ORIGIN_CENTER_OF_MASS') 
-        bpy.ops.object.select_all(action='DESELECT')
-        
-#Tolerance. Not sure why it needs its own method, but OK.  
-def tol(v1, v2):
-    return (v1 - v2).length < 0.01
-
 #Used for CPK tools
 def AlignX(v1,v2):
     dvec=v2-v1
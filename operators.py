@@ -71,6 +71,11 @@ class ImportX3DE(Operator, ImportHelper, IOX3DOrientationHelper):
 
     filename_ext = ".x3d"
     filter_glob = StringProperty(default="*.x3d;*.wrl", options={'HIDDEN'})
+    PREF_SHARED_PRIMITIVES = BoolProperty(
+            name="Share Primitive Meshes",
+            description="Spheres and cylinders share one mesh per detail level until clean up",
+            default=True,
+            )
 
     def execute(self, context):
         from . import import_x3de
@@ -93,7 +98,6 @@ class MolPrintClean(Operator):
     bl_label = "Clean up import mesh"
     def execute(self, context):
         delete_list = []
-        splitcyllist = []
         #Remove all non-mesh objects first so they are out of the way
         for obj in bpy.context.scene.objects:
             obj["conelist"] = ['None']
@@ -104,34 +108,34 @@ class MolPrintClean(Operator):
             if obj.type != 'MESH':
                 bpy.context.scene.objects.unlink(obj)
 
+        #Shared primitive meshes from import get their real size back.
+        #Before make_single_user, which would copy the templates as they are
+        import_x3de.realizeSharedPrimitives(bpy.context.scene.objects)
         #Make all linked objects single user: Jmol issue
         bpy.ops.object.make_single_user(type='ALL',object=True,obdata=True)
-        #Generate a list of pairs of existing objects to do comparisons against
-        objlist = itertools.combinations(bpy.context.scene.objects, 2)
+        #Bounding boxes and dimensions still hold the unit templates until an update
+        bpy.context.scene.update()
+        #Remove duplicate cylinders that can cause issues
+        delete_list += mesh_helpers.duplicate_cylinders(bpy.context.scene.objects)
+        duplicates = {ob.name for ob in delete_list}
+        #Generate pairs of existing objects to do comparisons against
+        #Nothing below looks further than 0.3 units, so let the KDTree skip the rest
+        objlist = mesh_helpers.neighbor_pairs(bpy.context.scene.objects, 0.3)
         #TODO: Make this whole thing more pythonic
         for (a,b) in objlist:
+            if a.name in duplicates or b.name in duplicates:
+                continue
             distance = mesh_helpers.get_distance(a,b)
             #Sphere check for internal objects, old pymol files require such a high distance check
             if a['ptype'] and b['ptype'] == 'Sphere' and distance < 0.3:
                 inside = mesh_helpers.isinside(a,b)
                 if inside:
                     delete_list.append(inside)
-            #Remove duplicate cylinders that can cause issues
-            if a['ptype'] and b['ptype'] == 'Cylinder' and distance < 0.0001:
-                delete_list.append(b)
-                continue
-            #Clyinder check for 'split' cylinder bonds
-            if a['ptype'] and b['ptype'] == 'Cylinder' and distance < 2:
-                splitcyllist = mesh_helpers.check_split_cyls(a,b,splitcyllist)    
+        #Clyinder check for 'split' cylinder bonds
+        splitcyllist = mesh_helpers.split_cyl_pairs(ob for ob in bpy.context.scene.objects if ob.name not in duplicates)
         #Delete everything that is in the delete list if it still exists
-        #TODO: Make this more pythonic             
-        for each in delete_list:
-            try:
-                bpy.ops.object.select_all(action='DESELECT')
-                each.select = True
-                bpy.ops.object.delete() 
-            except:
-                continue
+        freed = mesh_helpers.remove_objects(delete_list)
+        print("Clean removed objects, meshes: ", freed)
         #Join split cylinders if they exist        
         if len(splitcyllist) > 0:
             mesh_helpers.merge_split_cyls(splitcyllist)
@@ -156,47 +160,38 @@ class MolPrintGetInteractions(Operator):
                   
     @staticmethod
     def getinteractions(context):
-        interactionlist = []
-    #Build a complete list of interactions between objects to speed up joining
+        graph = mesh_helpers.InteractionGraph()
+    #Build a complete graph of interactions between objects to speed up joining
     #Uses a 2 unit distance cutoff. This may impact long generated struts?
-        objlist = itertools.combinations(bpy.context.scene.objects, 2)
+    #Only pairs inside the cutoff come back from the neighbor search
+        objlist = mesh_helpers.neighbor_pairs(bpy.context.scene.objects, 2)
         for each in objlist:
-            #Ignore cylinder-cylinder interactions
-            if (each[0]["ptype"] == 'Cylinder') and (each[1]["ptype"] == 'Cylinder'):
+            #Only sphere-cylinder contacts go in the graph
+            if (each[0]["ptype"], each[1]["ptype"]) not in (('Sphere','Cylinder'), ('Cylinder','Sphere')):
                 continue
-            distance = mesh_helpers.get_distance(each[0],each[1])
-            intersect = False
-            if distance < 2:	
-                intersect = mesh_helpers.bmesh_check_intersect_objects(each[0], each[1])
+            intersect = mesh_helpers.bmesh_check_intersect_objects(each[0], each[1])
             if intersect:
                 if each[0]["ptype"] == 'Sphere':
-                    interactionlist.append([each[0].name,each[1].name])
+                    graph.add(each[0].name,each[1].name)
                 if each[0]["ptype"] == 'Cylinder':
-                    interactionlist.append([each[1].name,each[0].name])     
+                    graph.add(each[1].name,each[0].name)
                 
-        return interactionlist
+        return graph
         
     def execute(self, context):
-        ial = self.getinteractions(context)
-        bpy.context.scene.molprint_lists.internames = ial
+        bpy.context.scene.molprint_lists.interactiongraph = self.getinteractions(context)
         bpy.ops.mesh.molprint_objinteract()
         bpy.context.scene.molprint.interact = True
         bpy.context.scene.molprint_lists.selectedlist = bpy.context.selected_objects
         return {'FINISHED'}
         
 class MolPrintObjInteract(Operator):
-    """Make a name list into an object list"""
+    """Drop interaction graph entries for objects no longer in the scene"""
     bl_idname = "mesh.molprint_objinteract"
-    bl_label = "Convert name list to object list"
+    bl_label = "Prune interaction graph"
     def execute(self, context):
-        interaction_list = []
-       
-        for each in bpy.context.scene.molprint_lists.internames:
-            pair = []
-            for name in each:
-                pair.append(bpy.data.objects[name])
-            interaction_list.append(pair)
-        bpy.context.scene.molprint_lists.interactionlist = interaction_list
+        names = set(bpy.context.scene.objects.keys())
+        bpy.context.scene.molprint_lists.interactiongraph.prune(names)
         return {'FINISHED'}
             
 class MolPrintAddStrut(Operator):
@@ -442,11 +437,10 @@ class MolPrintCPKSplit(Operator):
                 for modifier in each.modifiers:
                     bpy.context.scene.objects.active = each
                     bpy.ops.object.modifier_apply(modifier=modifier.name)
+                mesh_helpers.flush_bvh_cache(each)
         #Delete all extra objects
-        for each in bpy.context.scene.objects:
-            if each['ptype'] == "CPKcyl":
-                each.select = True
-                bpy.ops.object.delete()
+        freed = mesh_helpers.remove_objects([each for each in bpy.context.scene.objects if each['ptype'] == "CPKcyl"])
+        print("CPK removed objects, meshes: ", freed)
                 
         #Create list that contains all atoms by radius.
         unique = mesh_helpers.radius_sort(bpy.context.scene.objects)
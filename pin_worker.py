@@ -0,0 +1,57 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8-80 compliant>
+
+# Background worker for Pin and Join, started by mesh_helpers.finish_groups_parallel:
+#   blender -b --factory-startup --python pin_worker.py -- package result name pinscale splitpins
+# Loads one joined group with its pins from package, runs finish_group on it
+# and writes the new object to result. Not part of the addon when it is loaded.
+
+import importlib
+import os
+import sys
+import bpy
+
+# mesh_helpers is imported through the addon package, as the addon itself
+# does. The addon is not registered here, so finish_group gets its settings
+# as arguments instead of from scene.molprint.
+addon_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(addon_dir))
+mesh_helpers = importlib.import_module(os.path.basename(addon_dir) + ".mesh_helpers")
+
+def main(argv):
+    package, result, name, pinscale, splitpins = argv
+    scene = bpy.context.scene
+    #Clear the startup file so loaded objects keep the names the pinlists use
+    for ob in list(bpy.data.objects):
+        bpy.data.objects.remove(ob, do_unlink=True)
+
+    with bpy.data.libraries.load(package) as (data_from, data_to):
+        data_to.objects = data_from.objects
+    for ob in data_to.objects:
+        scene.objects.link(ob)
+    scene.update()
+
+    newcube = mesh_helpers.finish_group(scene.objects[name], splitpins == "1", float(pinscale))
+    #The addon puts the group's palette material back
+    newcube.data.materials.clear()
+    bpy.data.libraries.write(result, set([newcube]), fake_user=True)
+
+if __name__ == "__main__":
+    main(sys.argv[sys.argv.index("--") + 1:])
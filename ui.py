@@ -125,6 +125,7 @@ class MolPrintToolBar4(MolPrintToolBar,Panel):
         row = layout.row()
         rowsub = layout.row(align=True)
         rowsub.prop(molprint,"autogroup")
+        rowsub.prop(molprint,"group_delay", text="Delay")
         rowsub = layout.row(align=True)
         rowsub.operator("mesh.molprint_selecthbonds", text="Select H-bonds")
         rowsub = layout.row(align=True)
@@ -169,6 +170,9 @@ class MolPrintToolBar5(MolPrintToolBar,Panel):
         rowsub = layout.row(align=True)
         rowsub.prop(molprint,"multicolor")
         rowsub = layout.row(align=True)
+        rowsub.prop(molprint,"parallel_groups")
+        rowsub.prop(molprint,"group_workers")
+        rowsub = layout.row(align=True)
    
         rowsub.operator("mesh.molprint_pinjoin", text="Pin and Join")
 